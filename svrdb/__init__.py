@@ -1,8 +1,14 @@
-__all__ = [ 'svrlist', 'svrfactory', 'tornado', 'searchable', 'fips' ]
+__all__ = [ 'svrlist', 'svrfactory', 'tornado', 'searchable', 'fips', 'spatial', 'cluster', 'cache', 'columnar', 'profiling', 'geometry', 'climatology', 'partitioned', 'difftest' ]
 
 import warnings
 
 with warnings.catch_warnings():
     warnings.simplefilter('ignore')
-    from .svrlist import TornadoList, WindList, HailList
-    from .searchable import byyear, bymonth, bycday, byhour
+    from .svrlist import TornadoList, SegmentList, WindList, HailList
+    from .wind import MagType
+    from .searchable import byyear, bymonth, bycday, byhour, bytime
+    from .spatial import join_nearby
+    from .geometry import Region, load_regions
+    from .climatology import Climatology
+    from .partitioned import PartitionedDB
+    from .profiling import instrument
@@ -0,0 +1,47 @@
+import sys
+import argparse
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m svrdb', description='SPC severe weather database tools')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = subparsers.add_parser('serve', help='Serve searches of the databases over HTTP')
+    serve_parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: %(default)s)')
+    serve_parser.add_argument('--port', type=int, default=8000, help='Port to listen on (default: %(default)s)')
+    serve_parser.add_argument('--workers', type=int, default=None, help='Number of worker threads for searches')
+    serve_parser.add_argument('--cache-size', type=int, default=128, help='Number of search results to cache per database (default: %(default)s)')
+    serve_parser.add_argument('--processes', action='store_true', help='Run searches on worker processes instead of threads')
+
+    pack_parser = subparsers.add_parser('pack-data', help='Write compressed or columnar copies of the bundled databases')
+    pack_parser.add_argument('--format', default='gz', choices=['zst', 'gz', 'xz', 'bz2', 'svrc'], help='Format to write (default: %(default)s)')
+
+    verify_parser = subparsers.add_parser('verify', help='Check the fast search paths against the reference implementation on random data')
+    verify_parser.add_argument('--seed', type=int, default=0, help='Random seed (default: %(default)s)')
+    verify_parser.add_argument('--datasets', type=int, default=2, help='Number of datasets of each kind (default: %(default)s)')
+    verify_parser.add_argument('--reports', type=int, default=300, help='Number of reports in each dataset (default: %(default)s)')
+    verify_parser.add_argument('--queries', type=int, default=40, help='Number of random searches on each dataset (default: %(default)s)')
+    verify_parser.add_argument('--kind', action='append', dest='kinds', choices=['tornado', 'segment', 'wind', 'hail'], help='Kind of database to check (default: all)')
+    verify_parser.add_argument('--engine', action='append', dest='engines', help='Search engine to check (default: all)')
+
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        from .server import serve
+        serve(host=args.host, port=args.port, workers=args.workers, cache_size=args.cache_size, processes=args.processes)
+    elif args.command == 'pack-data':
+        from .svrlist import TornadoList, WindList, HailList
+        for cls in [ TornadoList, WindList, HailList ]:
+            print("Wrote %s" % cls.pack_db(fmt=args.format))
+    elif args.command == 'verify':
+        from .difftest import verify, format_divergences
+        divergences = verify(seed=args.seed, n_datasets=args.datasets, n_reports=args.reports, n_queries=args.queries,
+                             kinds=args.kinds, engines=args.engines, log=print)
+        if len(divergences) > 0:
+            print(format_divergences(divergences))
+            print("%d divergences" % len(divergences))
+            sys.exit(1)
+        print("No divergences")
+
+
+if __name__ == "__main__":
+    main()
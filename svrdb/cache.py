@@ -0,0 +1,94 @@
+import sys
+import threading
+from collections import OrderedDict, namedtuple
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'max_bytes', 'currsize', 'nbytes'])
+
+def _canonical_value(val):
+    key = getattr(val, 'key', None)
+    if key is not None:
+        return key
+
+    if callable(val):
+        # Arbitrary functions could match anything, so there's no safe way to cache them
+        return None
+
+    if isinstance(val, str):
+        return frozenset([val])
+
+    try:
+        vals = list(val)
+    except TypeError:
+        return frozenset([val])
+
+    if any(callable(v) for v in vals):
+        # A list of functions means all of them have to match
+        keys = [ _canonical_value(v) for v in vals ]
+        if any(k is None or not callable(v) for k, v in zip(keys, vals)):
+            return None
+        return ('all', frozenset(keys))
+
+    return frozenset(vals)
+
+
+def query_key(conditions, aliases):
+    query = []
+    for attr, val in conditions:
+        val_key = _canonical_value(val)
+        if val_key is None:
+            return None
+        query.append((aliases.get(attr, attr), val_key))
+
+    try:
+        return frozenset(query)
+    except TypeError:
+        return None
+
+
+def result_nbytes(svr_list):
+    return sys.getsizeof(svr_list._lst) + sum(col.nbytes for col in svr_list._columns.values())
+
+
+class QueryCache(object):
+    def __init__(self, maxsize=128, max_bytes=None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._results = OrderedDict()
+            self._nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            try:
+                result, _ = self._results[key]
+            except KeyError:
+                self.misses += 1
+                return None
+
+            self._results.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, result, nbytes):
+        if self.max_bytes is not None and nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._results:
+                self._nbytes -= self._results.pop(key)[1]
+
+            self._results[key] = (result, nbytes)
+            self._nbytes += nbytes
+
+            while len(self._results) > self.maxsize or (self.max_bytes is not None and self._nbytes > self.max_bytes):
+                _, (_, old_nbytes) = self._results.popitem(last=False)
+                self._nbytes -= old_nbytes
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, self.max_bytes, len(self._results), self._nbytes)
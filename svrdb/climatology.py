@@ -0,0 +1,259 @@
+from .spatial import _track_points, _gc_dist, _sample_spacing, _earth_radius
+from .profiling import stage
+
+import os
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+_km_per_mile = 1.609344
+_km_per_deg = np.pi * _earth_radius / 180.
+
+# Days in the climatology calendar (every year gets a Feb. 29, which is only filled in leap years)
+_n_days = 366
+_feb29 = 59
+
+def _is_leap(years):
+    years = np.asarray(years)
+    return (years % 4 == 0) & ((years % 100 != 0) | (years % 400 == 0))
+
+
+def _convective_days(timestamps):
+    # Convective days run from 12Z to 12Z
+    days = (np.asarray(timestamps, dtype=np.int64) - 12 * 3600) // 86400
+    dates = np.datetime64('1970-01-01', 'D') + days
+    year_start = dates.astype('datetime64[Y]')
+    years = year_start.astype(np.int64) + 1970
+
+    doy = (dates - year_start.astype('datetime64[D]')).astype(np.int64)
+    doy[(~_is_leap(years)) & (doy >= _feb29)] += 1
+    return years, doy
+
+
+def _year_occurrence(doy, lats, lons, lat_ctrs, lon_ctrs, km):
+    # Sorted, unique (day of year, grid point) keys for the grid points within km of a report on each day
+    n_lat, n_lon = len(lat_ctrs), len(lon_ctrs)
+    if len(doy) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # Search a window of grid points around the nearest one that's wide enough for the highest latitude on the grid
+    lat_spacing = np.diff(lat_ctrs).min() if n_lat > 1 else np.inf
+    lon_spacing = np.diff(lon_ctrs).min() if n_lon > 1 else np.inf
+    max_cos = np.cos(np.radians(min(np.abs(lat_ctrs).max(), 89.)))
+    lat_rad = int(np.ceil(km / (_km_per_deg * lat_spacing))) if n_lat > 1 else 0
+    lon_rad = int(np.ceil(km / (_km_per_deg * lon_spacing * max_cos))) if n_lon > 1 else 0
+
+    near_lat = np.clip(np.searchsorted(lat_ctrs, lats), 0, n_lat - 1)
+    near_lon = np.clip(np.searchsorted(lon_ctrs, lons), 0, n_lon - 1)
+
+    keys = []
+    for dlat in range(-lat_rad - 1, lat_rad + 1):
+        row = near_lat + dlat
+        in_row = (row >= 0) & (row < n_lat)
+        for dlon in range(-lon_rad - 1, lon_rad + 1):
+            col = near_lon + dlon
+            valid = in_row & (col >= 0) & (col < n_lon)
+            valid[valid] = _gc_dist(lats[valid], lons[valid], lat_ctrs[row[valid]], lon_ctrs[col[valid]]) <= km
+            keys.append((doy[valid] * n_lat + row[valid]) * n_lon + col[valid])
+
+    return np.unique(np.concatenate(keys))
+
+
+def _fingerprint(*arrays):
+    digest = hashlib.sha1()
+    for arr in arrays:
+        digest.update(np.ascontiguousarray(arr).tobytes())
+    return digest.hexdigest()
+
+
+def _gaussian(sigma, spacing):
+    half_width = int(np.ceil(3 * sigma / spacing))
+    offsets = np.arange(-half_width, half_width + 1)
+    weights = np.exp(-0.5 * (offsets * spacing / sigma) ** 2)
+    return offsets, weights / weights.sum()
+
+
+def _smooth_time(daily, sigma_days):
+    if sigma_days <= 0:
+        return daily
+
+    # The calendar wraps around, so the end of December is smoothed with the beginning of January
+    offsets, weights = _gaussian(sigma_days, 1.)
+    smoothed = np.zeros_like(daily)
+    for offset, weight in zip(offsets, weights):
+        smoothed += weight * np.roll(daily, offset, axis=0)
+    return smoothed
+
+
+def _shift(arr, offset, axis):
+    # Shift with zeros coming in from outside the grid
+    shifted = np.zeros_like(arr)
+    src = [ slice(None) ] * arr.ndim
+    dst = [ slice(None) ] * arr.ndim
+    if offset >= 0:
+        src[axis] = slice(0, arr.shape[axis] - offset)
+        dst[axis] = slice(offset, None)
+    else:
+        src[axis] = slice(-offset, None)
+        dst[axis] = slice(0, arr.shape[axis] + offset)
+    shifted[tuple(dst)] = arr[tuple(src)]
+    return shifted
+
+
+def _smooth_space(daily, lat_ctrs, lon_ctrs, sigma_km):
+    if sigma_km <= 0:
+        return daily
+
+    smoothed = daily
+    if len(lat_ctrs) > 1:
+        offsets, weights = _gaussian(sigma_km, _km_per_deg * np.diff(lat_ctrs).mean())
+        smoothed = sum(weight * _shift(smoothed, offset, 1) for offset, weight in zip(offsets, weights))
+
+    if len(lon_ctrs) > 1:
+        # Grid points get closer together toward the poles, so the weights depend on the latitude
+        lon_spacing = _km_per_deg * np.diff(lon_ctrs).mean() * np.cos(np.radians(lat_ctrs))
+        half_width = int(np.ceil(3 * sigma_km / lon_spacing.min()))
+        offsets = np.arange(-half_width, half_width + 1)
+        weights = np.exp(-0.5 * (offsets[:, np.newaxis] * lon_spacing[np.newaxis, :] / sigma_km) ** 2)
+        weights /= weights.sum(axis=0)
+        smoothed = sum(weight[:, np.newaxis] * _shift(smoothed, offset, 2) for offset, weight in zip(offsets, weights))
+
+    return smoothed
+
+
+class Climatology(object):
+    def __init__(self, lat_edges=None, lon_edges=None, km=25 * _km_per_mile, sigma_days=15, sigma_km=120, cache_dir=None):
+        # The grid defaults to 0.5 degree boxes over the CONUS. The occurrences for each year are saved in cache_dir if
+        # it's given, so they're only computed once.
+        if lat_edges is None:
+            lat_edges = np.arange(20, 55.25, 0.5)
+        if lon_edges is None:
+            lon_edges = np.arange(-130, -59.75, 0.5)
+
+        lat_edges = np.asarray(lat_edges, dtype=float)
+        lon_edges = np.asarray(lon_edges, dtype=float)
+        self.lats = (lat_edges[:-1] + lat_edges[1:]) / 2
+        self.lons = (lon_edges[:-1] + lon_edges[1:]) / 2
+        self.km = km
+        self.sigma_days = sigma_days
+        self.sigma_km = sigma_km
+        self.cache_dir = cache_dir
+
+        # Occurrences for each year, as (fingerprint, keys) pairs
+        self._years = {}
+        self._daily = None
+        self._frequency = None
+
+    def _cache_fname(self, year):
+        params = _fingerprint(self.lats, self.lons, np.array([self.km]))
+        return os.path.join(self.cache_dir, "occurrence_%s_%d.npz" % (params[:16], year))
+
+    def _load_cached(self, year, fingerprint):
+        if self.cache_dir is None:
+            return None
+
+        try:
+            with np.load(self._cache_fname(year)) as cached:
+                if str(cached['fingerprint']) == fingerprint:
+                    return cached['keys']
+        except (OSError, KeyError, ValueError):
+            pass
+        return None
+
+    def _save_cached(self, year, fingerprint, keys):
+        if self.cache_dir is None:
+            return
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        np.savez(self._cache_fname(year), fingerprint=np.array(fingerprint), keys=keys)
+
+    def update(self, svr_list, workers=None):
+        # Only the years that are new or changed (and aren't in the cache) are computed, on up to `workers` processes
+        with stage('climatology', db=type(svr_list).__name__) as stg:
+            _, times, lats, lons = _track_points(svr_list, _sample_spacing(self.km))
+            years, doy = _convective_days(times)
+            stg.rows = len(svr_list)
+
+            order = np.argsort(years, kind='stable')
+            years, doy, lats, lons = years[order], doy[order], lats[order], lons[order]
+            uniq_years, starts = np.unique(years, return_index=True)
+            splits = starts[1:]
+
+            todo = []
+            for year, yr_doy, yr_lats, yr_lons in zip(uniq_years, np.split(doy, splits), np.split(lats, splits), np.split(lons, splits)):
+                year = int(year)
+                fingerprint = _fingerprint(yr_doy, yr_lats, yr_lons)
+                if year in self._years and self._years[year][0] == fingerprint:
+                    continue
+
+                keys = self._load_cached(year, fingerprint)
+                if keys is not None:
+                    self._years[year] = (fingerprint, keys)
+                else:
+                    todo.append((year, fingerprint, yr_doy, yr_lats, yr_lons))
+
+            with stage('occurrence') as occ_stg:
+                occ_stg.rows = len(todo)
+                args = [ (yr_doy, yr_lats, yr_lons, self.lats, self.lons, self.km) for _, _, yr_doy, yr_lats, yr_lons in todo ]
+                if len(todo) <= 1 or workers == 1:
+                    results = [ _year_occurrence(*arg) for arg in args ]
+                else:
+                    with ProcessPoolExecutor(max_workers=workers) as pool:
+                        results = list(pool.map(_year_occurrence, *zip(*args)))
+
+            for (year, fingerprint, _, _, _), keys in zip(todo, results):
+                self._years[year] = (fingerprint, keys)
+                self._save_cached(year, fingerprint, keys)
+
+        if len(todo) > 0:
+            self._daily = None
+            self._frequency = None
+        return self
+
+    @property
+    def years(self):
+        return sorted(self._years.keys())
+
+    def occurrence(self, year):
+        # Whether there was a report near each grid point on each day; day 59 (Feb. 29) is false in non-leap years
+        occ = np.zeros(_n_days * len(self.lats) * len(self.lons), dtype=bool)
+        occ[self._years[year][1]] = True
+        return occ.reshape(_n_days, len(self.lats), len(self.lons))
+
+    @property
+    def daily(self):
+        # Unsmoothed fraction of years with a report near each grid point on each day
+        if self._daily is None:
+            years = self.years
+            n_cells = len(self.lats) * len(self.lons)
+            counts = np.zeros(_n_days * n_cells)
+            for year in years:
+                counts += np.bincount(self._years[year][1], minlength=_n_days * n_cells)
+
+            n_years = np.full(_n_days, len(years), dtype=float)
+            n_years[_feb29] = _is_leap(years).sum() if len(years) > 0 else 0
+            with np.errstate(divide='ignore', invalid='ignore'):
+                daily = counts.reshape(_n_days, n_cells) / n_years[:, np.newaxis]
+            daily[~np.isfinite(daily)] = 0.
+            self._daily = daily.reshape(_n_days, len(self.lats), len(self.lons))
+        return self._daily
+
+    @property
+    def frequency(self):
+        # Smoothed probability of a report near each grid point on each day
+        if self._frequency is None:
+            with stage('smooth'):
+                self._frequency = _smooth_space(_smooth_time(self.daily, self.sigma_days), self.lats, self.lons, self.sigma_km)
+        return self._frequency
+
+    def annual_days(self):
+        # Average number of days per year with a report near each grid point
+        return self.daily.sum(axis=0)
+
+
+def climatology(svr_list, lat_edges=None, lon_edges=None, km=25 * _km_per_mile, sigma_days=15, sigma_km=120,
+                cache_dir=None, workers=None):
+    clim = Climatology(lat_edges=lat_edges, lon_edges=lon_edges, km=km, sigma_days=sigma_days, sigma_km=sigma_km,
+                       cache_dir=cache_dir)
+    return clim.update(svr_list, workers=workers)
@@ -0,0 +1,63 @@
+from .spatial import SpaceTimeIndex, _sample_spacing
+
+import numpy as np
+
+def _connected_components(n_nodes, edge_a, edge_b):
+    labels = np.arange(n_nodes)
+    while True:
+        # Hook each component onto the smallest label it touches, then compress the paths
+        lowest = np.minimum(labels[edge_a], labels[edge_b])
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, labels[edge_a], lowest)
+        np.minimum.at(new_labels, labels[edge_b], lowest)
+
+        while True:
+            jumped = new_labels[new_labels]
+            if (jumped == new_labels).all():
+                break
+            new_labels = jumped
+
+        if (new_labels == labels).all():
+            return labels
+        labels = new_labels
+
+
+def cluster_labels(svr_list, km=50, minutes=60, min_reports=5):
+    n_svrs = len(svr_list)
+    index = SpaceTimeIndex.from_list(svr_list, _sample_spacing(km))
+    nbr_a, nbr_b = index.pairs(index, km, minutes)
+
+    # Every report is its own neighbor, so it counts towards min_reports
+    n_nbrs = np.bincount(nbr_a, minlength=n_svrs)
+    is_core = n_nbrs >= min_reports
+
+    core_edge = is_core[nbr_a] & is_core[nbr_b]
+    roots = _connected_components(n_svrs, nbr_a[core_edge], nbr_b[core_edge])
+
+    labels = np.full(n_svrs, -1, dtype=np.int64)
+    labels[is_core] = roots[is_core]
+
+    # Border reports join the cluster of a core report they're close to
+    border_edge = ~is_core[nbr_a] & is_core[nbr_b]
+    labels[nbr_a[border_edge]] = roots[nbr_b[border_edge]]
+
+    # Number the clusters consecutively (in order of their first report)
+    clustered = labels >= 0
+    _, labels[clustered] = np.unique(labels[clustered], return_inverse=True)
+    return labels
+
+
+def outbreaks(svr_list, km=50, minutes=60, min_reports=5, score=len):
+    labels = cluster_labels(svr_list, km=km, minutes=minutes, min_reports=min_reports)
+
+    order = np.argsort(labels, kind='stable')
+    splits = np.flatnonzero(np.diff(labels[order])) + 1
+
+    clusters = []
+    for members in np.split(order, splits):
+        if len(members) == 0 or labels[members[0]] < 0:
+            continue
+        clusters.append(svr_list._subset(members))
+
+    clusters.sort(key=score, reverse=True)
+    return clusters
@@ -0,0 +1,437 @@
+import os
+import json
+import math
+import mmap
+import struct
+from multiprocessing import shared_memory
+from datetime import datetime, timedelta
+
+import numpy as np
+
+_epoch = datetime(1970, 1, 1, 0)
+
+_magic = b'SVRC'
+_version = 3
+_preamble = struct.Struct('<4sIQ')
+_align = 64
+
+def _align_to(offset):
+    return (offset + _align - 1) // _align * _align
+
+
+def _is_nan(val):
+    return isinstance(val, float) and math.isnan(val)
+
+
+def _encode_lists(vals):
+    lengths = np.array([ len(v) for v in vals ], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    return [ np.array([ x for v in vals for x in v ], dtype=np.int64), offsets ]
+
+
+def _encode_column(vals):
+    col = {}
+    if all(isinstance(v, datetime) for v in vals):
+        col['kind'] = 'datetime'
+        arrays = [ np.array([ (v - _epoch) // timedelta(microseconds=1) for v in vals ], dtype=np.int64) ]
+
+    elif all(isinstance(v, list) for v in vals):
+        col['kind'] = 'list'
+        arrays = _encode_lists(vals)
+
+    elif all(isinstance(v, str) or v is None or _is_nan(v) for v in vals):
+        # Strings are dictionary-encoded, with negative codes for missing values
+        col['kind'] = 'str'
+        categories = sorted(set(v for v in vals if isinstance(v, str)))
+        cat_codes = dict((cat, code) for code, cat in enumerate(categories))
+        col['categories'] = categories
+        arrays = [ np.array([ cat_codes[v] if isinstance(v, str) else (-2 if v is None else -1) for v in vals ], dtype=np.int32) ]
+
+    elif all(isinstance(v, (bool, np.bool_)) for v in vals):
+        col['kind'] = 'bool'
+        arrays = [ np.array(vals, dtype=bool) ]
+
+    elif all(isinstance(v, (int, np.integer)) for v in vals):
+        col['kind'] = 'int'
+        arrays = [ np.array(vals, dtype=np.int64) ]
+
+    elif all(isinstance(v, (int, float, np.integer, np.floating)) for v in vals):
+        col['kind'] = 'float'
+        arrays = [ np.array(vals, dtype=np.float64) ]
+
+    elif all(isinstance(v, (int, float, np.integer, np.floating)) or v is None for v in vals):
+        # Missing numbers are masked, so they come back as None instead of NaN
+        is_int = all(isinstance(v, (int, np.integer)) for v in vals if v is not None)
+        col['kind'] = 'int' if is_int else 'float'
+        col['nullable'] = True
+        arrays = [ np.array([ 0 if v is None else v for v in vals ], dtype=np.int64 if is_int else np.float64),
+                   np.array([ v is None for v in vals ], dtype=bool) ]
+
+    else:
+        raise ValueError("Can't store a column with values of type %s" % ", ".join(sorted(set(type(v).__name__ for v in vals))))
+
+    return col, arrays
+
+
+def pack(svr_list):
+    unpacker = type(svr_list).unpacker
+    reports = []
+    layouts = []
+    item_offsets = [0]
+    for svr in svr_list:
+        svr_reports, layout = unpacker.disassemble(svr)
+        reports.extend(svr_reports)
+        layouts.append(layout)
+        item_offsets.append(len(reports))
+
+    attr_names = []
+    for rep in reports:
+        for name in rep._attrs.keys():
+            if name not in attr_names:
+                attr_names.append(name)
+
+    # How the reports fit together into items (e.g. tornado segments into tornadoes)
+    layout_arrays = _encode_lists(layouts)
+
+    columns = []
+    arrays = [ np.array(item_offsets, dtype=np.int64) ] + layout_arrays
+    for name in attr_names:
+        try:
+            vals = [ rep._attrs[name] for rep in reports ]
+        except KeyError:
+            raise ValueError("Column '%s' is missing from some reports" % name)
+
+        col, col_arrays = _encode_column(vals)
+        col['name'] = name
+        col['arrays'] = list(range(len(arrays), len(arrays) + len(col_arrays)))
+        columns.append(col)
+        arrays.extend(col_arrays)
+
+    header = {
+        'list_cls': type(svr_list).__name__,
+        'n_items': len(svr_list),
+        'n_reports': len(reports),
+        'time_sorted': svr_list._time_index() is None,
+        'columns': columns,
+        'list_columns': {'datetime': len(arrays)},
+    }
+    arrays.append(svr_list._timestamps())
+    return header, arrays
+
+
+def nbytes(header, arrays):
+    header = dict(header, array_info=[ {'dtype': arr.dtype.str, 'shape': arr.shape, 'offset': 0} for arr in arrays ])
+
+    # Leave room for the offsets to be filled in later
+    header_len = len(json.dumps(header)) + len(arrays) * 20
+    data_size = sum(_align_to(arr.nbytes) for arr in arrays)
+    return _align_to(_preamble.size + header_len) + data_size
+
+
+def write(buf, header, arrays):
+    array_info = []
+    offset = 0
+    for arr in arrays:
+        array_info.append({'dtype': arr.dtype.str, 'shape': arr.shape, 'offset': offset})
+        offset += _align_to(arr.nbytes)
+
+    header_bytes = json.dumps(dict(header, array_info=array_info)).encode('utf-8')
+    data_start = _align_to(_preamble.size + len(header_bytes))
+
+    buf[:_preamble.size] = _preamble.pack(_magic, _version, len(header_bytes))
+    buf[_preamble.size:(_preamble.size + len(header_bytes))] = header_bytes
+
+    for arr, info in zip(arrays, array_info):
+        start = data_start + info['offset']
+        buf[start:(start + arr.nbytes)] = np.ascontiguousarray(arr).tobytes()
+
+    return data_start + offset
+
+
+def read(buf):
+    magic, version, header_len = _preamble.unpack(bytes(buf[:_preamble.size]))
+    if magic != _magic:
+        raise ValueError("Not a columnar svrdb file")
+    if version != _version:
+        raise ValueError("Unsupported columnar svrdb version %d" % version)
+
+    header = json.loads(bytes(buf[_preamble.size:(_preamble.size + header_len)]).decode('utf-8'))
+    data_start = _align_to(_preamble.size + header_len)
+
+    arrays = []
+    for info in header['array_info']:
+        dtype = np.dtype(info['dtype'])
+        count = int(np.prod(info['shape']))
+        arr = np.frombuffer(buf, dtype=dtype, count=count, offset=data_start + info['offset']).reshape(info['shape'])
+        arr.flags.writeable = False
+        arrays.append(arr)
+
+    return header, arrays
+
+
+class ColumnarItems(object):
+    def __init__(self, unpacker, header, arrays, rows=None, buffer_owner=None):
+        self._unpacker = unpacker
+        self._header = header
+        self._arrays = arrays
+        self._item_offsets = arrays[0]
+        self._layouts = arrays[1:3]
+        self._columns = dict((col['name'], (col, [ arrays[idx] for idx in col['arrays'] ])) for col in header['columns'])
+
+        # Which items in the file this sequence holds (None for all of them)
+        self._rows = rows
+
+        # Keep the shared memory or mapped file open as long as anything is using it
+        self._buffer_owner = buffer_owner
+
+    def take(self, positions):
+        # A subset of the items that still reads from the same columns
+        rows = np.arange(len(self)) if self._rows is None else self._rows
+        return ColumnarItems(self._unpacker, self._header, self._arrays, rows=rows[positions], buffer_owner=self._buffer_owner)
+
+    def _row_ids(self):
+        return np.arange(self._header['n_items']) if self._rows is None else self._rows
+
+    def _decode(self, col, col_arrays, idx):
+        kind = col['kind']
+        if kind == 'datetime':
+            return _epoch + timedelta(microseconds=int(col_arrays[0][idx]))
+        elif kind == 'list':
+            values, offsets = col_arrays
+            return values[offsets[idx]:offsets[idx + 1]].tolist()
+        elif kind == 'str':
+            return self._decode_str(col, col_arrays[0][idx])
+        elif col.get('nullable', False) and col_arrays[1][idx]:
+            return None
+        return col_arrays[0][idx].item()
+
+    @staticmethod
+    def _decode_str(col, code):
+        if code >= 0:
+            return col['categories'][code]
+        return None if code == -2 else float('nan')
+
+    def _build(self, idx):
+        if self._rows is not None:
+            idx = self._rows[idx]
+
+        reports = []
+        for rep_idx in range(self._item_offsets[idx], self._item_offsets[idx + 1]):
+            attrs = dict((name, self._decode(col, col_arrays, rep_idx)) for name, (col, col_arrays) in self._columns.items())
+            reports.append(self._unpacker.from_attrs(attrs))
+
+        layout_vals, layout_offsets = self._layouts
+        return self._unpacker.assemble(reports, layout_vals[layout_offsets[idx]:layout_offsets[idx + 1]].tolist())
+
+    def _factorize(self, col, col_arrays, rep_idxs):
+        # Codes for the values of a scalar column in some reports, along with the value for each code
+        kind = col['kind']
+        vals = col_arrays[0][rep_idxs]
+        if kind == 'str':
+            uniq, codes = np.unique(vals, return_inverse=True)
+            nan = float('nan')
+            keys = [ nan if code == -1 else self._decode_str(col, code) for code in uniq ]
+        elif col.get('nullable', False):
+            mask = col_arrays[1][rep_idxs]
+            uniq, codes = np.unique(np.where(mask, 0, vals), return_inverse=True)
+            keys = uniq.tolist() + [ None ]
+            codes[mask] = len(uniq)
+        else:
+            uniq, codes = np.unique(vals, return_inverse=True)
+            keys = uniq.tolist()
+            if kind == 'float' and len(keys) > 0 and keys[-1] != keys[-1]:
+                # NaNs all go in one group
+                keys[-1] = float('nan')
+        return codes.ravel(), keys
+
+    def postings(self, name):
+        # Inverted index of the items' values of a column, made straight from the columns (None if it can't be)
+        reducer = self._unpacker.item_reducer(name)
+        if reducer is None or name not in self._columns:
+            return None
+
+        # 'argmax:<col>' is the value from the report with the largest value of <col>
+        reducer, _, max_name = reducer.partition(':')
+        max_name = max_name or name
+
+        col, col_arrays = self._columns[name]
+        if col['kind'] == 'datetime':
+            return None
+        if reducer in ('max', 'argmax'):
+            max_col, max_arrays = self._columns.get(max_name, (None, None))
+            if max_col is None or max_col['kind'] not in ('int', 'float') or max_col.get('nullable', False):
+                return None
+
+        # The reports that make up the items' values, and which item each one goes with
+        row_ids = self._row_ids()
+        if len(row_ids) == 0:
+            return {}, False
+        starts = self._item_offsets[row_ids]
+        if reducer == 'first':
+            counts = np.ones(len(row_ids), dtype=np.int64)
+        else:
+            counts = np.asarray(self._unpacker.n_main_reports(self._item_offsets, *self._layouts), dtype=np.int64)[row_ids]
+        items = np.repeat(np.arange(len(row_ids)), counts)
+        rep_idxs = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+        if reducer in ('max', 'argmax'):
+            max_vals = max_arrays[0][rep_idxs]
+            nonempty = counts > 0
+            group_starts = (np.cumsum(counts) - counts)[nonempty]
+            if len(max_vals) == 0:
+                return {}, False
+
+            item_max = np.maximum.reduceat(max_vals, group_starts)
+            is_max = np.flatnonzero(max_vals == np.repeat(item_max, counts[nonempty]))
+            first_max = is_max[np.unique(items[is_max], return_index=True)[1]]
+
+            codes, keys = self._factorize(col, col_arrays, rep_idxs[first_max])
+            items = items[first_max]
+            multi_valued = False
+
+        elif col['kind'] == 'list':
+            values, offsets = col_arrays
+            lengths = offsets[rep_idxs + 1] - offsets[rep_idxs]
+            elem_idxs = np.repeat(offsets[rep_idxs] - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            items = np.repeat(items, lengths)
+            uniq, codes = np.unique(values[elem_idxs], return_inverse=True)
+            codes, keys = codes.ravel(), uniq.tolist()
+            multi_valued = True
+
+        else:
+            codes, keys = self._factorize(col, col_arrays, rep_idxs)
+            multi_valued = reducer == 'all'
+
+        # Each item is listed once under each of its values, in order
+        pairs = np.unique(codes.astype(np.int64) * len(row_ids) + items)
+        pair_codes, pair_items = np.divmod(pairs, len(row_ids))
+        splits = np.flatnonzero(np.diff(pair_codes)) + 1
+        postings = dict((keys[grp_codes[0]], grp_items) for grp_codes, grp_items in
+                        zip(np.split(pair_codes, splits), np.split(pair_items, splits)) if len(grp_codes) > 0)
+        return postings, multi_valued
+
+    def __len__(self):
+        return self._header['n_items'] if self._rows is None else len(self._rows)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return tuple(self[idx] for idx in range(*key.indices(len(self))))
+        elif not isinstance(key, (int, np.integer)):
+            raise TypeError("Items are looked up by position")
+
+        # Items aren't kept around after they're built, so they don't pile up in memory
+        if key < 0:
+            key += len(self)
+        if key < 0 or key >= len(self):
+            raise IndexError("Item index out of range")
+        return self._build(key)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self._build(idx)
+
+
+def build_list(list_cls, header, arrays, buffer_owner=None):
+    if header['list_cls'] != list_cls.__name__:
+        raise ValueError("Data are for a %s, not a %s" % (header['list_cls'], list_cls.__name__))
+
+    # Reports are only built from the columns when they're used
+    svr_list = list_cls()
+    svr_list._lst = ColumnarItems(list_cls.unpacker, header, arrays, buffer_owner=buffer_owner)
+    for name, idx in header['list_columns'].items():
+        svr_list._columns[name] = arrays[idx]
+    if header['time_sorted']:
+        svr_list._indexes['time_order'] = None
+    return svr_list
+
+
+def save(svr_list, fname, source=None):
+    # `source` is anything JSON-serializable that says where the data came from, for read_header() to give back
+    header, arrays = pack(svr_list)
+    if source is not None:
+        header['source'] = source
+    size = nbytes(header, arrays)
+    buf = bytearray(size)
+    used = write(memoryview(buf), header, arrays)
+    with open(fname, 'wb') as fobj:
+        fobj.write(memoryview(buf)[:used])
+
+
+def read_header(fname):
+    with open(fname, 'rb') as fobj:
+        magic, version, header_len = _preamble.unpack(fobj.read(_preamble.size))
+        if magic != _magic:
+            raise ValueError("Not a columnar svrdb file")
+        return json.loads(fobj.read(header_len).decode('utf-8'))
+
+
+def load(list_cls, fname):
+    with open(fname, 'rb') as fobj:
+        buf = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+
+    header, arrays = read(buf)
+    return build_list(list_cls, header, arrays, buffer_owner=buf)
+
+
+# Names of the shared memory published by this process
+_published = set()
+
+class SharedDatabase(object):
+    def __init__(self, shm):
+        self._shm = shm
+        self.name = shm.name
+
+    def close(self):
+        self._shm.close()
+
+    def unlink(self):
+        self._shm.unlink()
+        _published.discard(self.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        self.unlink()
+
+
+def publish(svr_list, name=None):
+    header, arrays = pack(svr_list)
+    shm = shared_memory.SharedMemory(name=name, create=True, size=nbytes(header, arrays))
+    write(shm.buf, header, arrays)
+    _published.add(shm.name)
+    return SharedDatabase(shm)
+
+
+class _AttachedMemory(shared_memory.SharedMemory):
+    def __del__(self):
+        # Arrays read from the memory can outlive this object when they're garbage collected together, in which case
+        # the mapping goes away with the last of them instead
+        try:
+            self.close()
+        except BufferError:
+            pass
+
+
+def _open_shared_memory(name):
+    try:
+        # Python 3.13+: attaching doesn't register the memory with the resource tracker
+        return _AttachedMemory(name=name, track=False)
+    except TypeError:
+        pass
+
+    # WORKAROUND for Python < 3.13 (https://github.com/python/cpython/issues/82300): attaching registers the memory
+    # with the resource tracker, which would unlink it when this process exits even though the publisher still owns
+    # it, so take it back out. Memory this process published stays registered, since that's the publisher's entry.
+    shm = _AttachedMemory(name=name)
+    if os.name == 'posix' and shm.name not in _published:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister('/' + shm.name.lstrip('/'), 'shared_memory')
+    return shm
+
+
+def attach(list_cls, name):
+    shm = _open_shared_memory(name)
+    header, arrays = read(shm.buf)
+    return build_list(list_cls, header, arrays, buffer_owner=shm)
@@ -0,0 +1,681 @@
+# Differential tests: check the fast paths against a slow reference implementation on random SPC-format datasets
+from .svrlist import TornadoList, SegmentList, WindList, HailList
+from .searchable import Searchable, _epoch, byyear, bymonth, bycday, byhour, bytime
+from .partitioned import PartitionedDB
+from .tornado import TornadoSegment, Tornado
+from .wind import Wind
+from .hail import Hail
+from .fips import fips
+
+import os
+import gzip
+import math
+import random
+import tempfile
+import contextlib
+from datetime import datetime, timedelta
+from collections import OrderedDict, namedtuple, defaultdict, Counter
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+
+Divergence = namedtuple('Divergence', ['check', 'kind', 'engine', 'case', 'detail'])
+
+_cols = ["om", "yr", "mo", "dy", "date", "time", "tz", "st", "stf", "stn", "mag", "inj", "fat", "loss", "closs",
+         "slat", "slon", "elat", "elon", "len", "wid", "ns", "sn", "sg", "f1", "f2", "f3", "f4"]
+
+# States and counties to put reports in, including some county codes that get corrected when they're parsed
+_states = [
+    ('OK', 40, [27, 109, 17, 31]),
+    ('KS', 20, [173, 79, 15, 91]),
+    ('TX', 48, [201, 113, 439]),
+    ('AL', 1, [125, 73, 89]),
+    ('SD', 46, [131, 103]),
+    ('FL', 12, [25, 86]),
+    ('VA', 51, [123, 39]),
+    ('GA', 13, [597, 121]),
+]
+
+# Columns that are only in the CSV files (the date, time, and counties are combined when they're parsed)
+_csv_attrs = set(['yr', 'mo', 'dy', 'date', 'time', 'tz', 'f1', 'f2', 'f3', 'f4'])
+
+_list_classes = OrderedDict([
+    ('tornado', TornadoList),
+    ('segment', SegmentList),
+    ('wind', WindList),
+    ('hail', HailList),
+])
+
+def _random_time(rng):
+    # Mostly random times, but some right at the edges of convective days and of the switch to the EF scale
+    choice = rng.random()
+    if choice < 0.15:
+        day = datetime(2005, 1, 1) + timedelta(days=rng.randint(0, 5 * 365))
+        return day.replace(hour=12) + timedelta(minutes=rng.choice([-1, 0, 1]))
+    elif choice < 0.2:
+        return datetime(2007, 2, 1, 0) + timedelta(minutes=rng.choice([-60, -1, 0, 1, 60]))
+    return datetime(2005, 1, 1) + timedelta(minutes=rng.randint(0, 60 * 24 * 365 * 5))
+
+
+def _row(rng, dt, st, stf, counties, mag, track, seg, om, extra):
+    # Most reports are in CST, but some are in GMT
+    tz = 9 if rng.random() < 0.1 else 3
+    local = dt if tz == 9 else dt - timedelta(hours=6)
+
+    slat, slon, elat, elon = track
+    ns, sn, sg = seg
+    counties = list(counties) + [0] * (4 - len(counties))
+    vals = dict(om=om, yr=local.year, mo=local.month, dy=local.day, date=local.strftime('%Y-%m-%d'),
+                time=local.strftime('%H:%M:%S'), tz=tz, st=st, stf=stf, stn=0, mag=mag, inj=rng.choice([0, 0, 0, 1, 3]),
+                fat=rng.choice([0, 0, 0, 0, 1]), loss=0, closs=0, slat=round(slat, 4), slon=round(slon, 4),
+                elat=round(elat, 4), elon=round(elon, 4), len=round(rng.random() * 20, 2), wid=rng.choice([25, 50, 100]),
+                ns=ns, sn=sn, sg=sg, f1=counties[0], f2=counties[1], f3=counties[2], f4=counties[3])
+    vals.update(extra)
+    return vals
+
+
+def _tornado_rows(rng, om):
+    dt = _random_time(rng)
+    mag = rng.choice([-9, 0, 0, 1, 1, 2, 3, 4, 5])
+    slat = 30 + rng.random() * 8
+    slon = -100 + rng.random() * 10
+    extra = {'fc': 0}
+
+    n_states = rng.choice([1, 1, 1, 1, 2, 3])
+    states = rng.sample(_states, n_states)
+
+    if n_states == 1:
+        st, stf, ctys = states[0]
+        if rng.random() < 0.2:
+            # Brief tornadoes have no end point
+            track = (slat, slon, 0, 0)
+        else:
+            track = (slat, slon, slat + rng.random() * 0.3, slon + rng.random() * 0.3)
+
+        counties = [ rng.choice(ctys) for _ in range(rng.choice([1, 1, 2, 5])) ]
+        rows = [ _row(rng, dt, st, stf, counties[:4], mag, track, (1, 1, 1), om, extra) ]
+        if len(counties) > 4:
+            # Counties past the fourth go on their own line
+            rows.append(_row(rng, dt, st, stf, counties[4:], mag, (0, 0, 0, 0), (1, 0, -9), om, extra))
+        return rows
+
+    # A line for the whole tornado, then one line for each state
+    step = 0.3
+    end = (slat + step * n_states, slon + step * n_states)
+    rows = [ _row(rng, dt, states[0][0], states[0][1], [states[0][2][0]], mag, (slat, slon) + end, (n_states, 0, 1), om, extra) ]
+    for idx, (st, stf, ctys) in enumerate(states):
+        track = (slat + step * idx, slon + step * idx, slat + step * (idx + 1), slon + step * (idx + 1))
+        rows.append(_row(rng, dt, st, stf, [rng.choice(ctys)], mag, track, (n_states, 1, 2), om, extra))
+    return rows
+
+
+def generate_csv(kind, n_reports, seed=0):
+    # Random SPC-format CSV text for 'tornado', 'wind', or 'hail' reports
+    rng = random.Random(seed)
+    cols = _cols + (['mt'] if kind == 'wind' else ['fc'])
+
+    rows = []
+    if kind == 'tornado':
+        # TornadoUnpacker.merge() patches these two tornadoes, so they have to be there
+        for yr, om in [ (1993, 74), (2006, 80) ]:
+            rows.append(_row(rng, datetime(yr, 5, 1, 20), 'KS', 20, [15], 2, (39.5, -99.5, 39.9, -99.9), (1, 1, 1), om, {'fc': 0}))
+
+        for om in range(1000, 1000 + n_reports):
+            rows.extend(_tornado_rows(rng, om))
+    else:
+        for om in range(1000, 1000 + n_reports):
+            st, stf, ctys = rng.choice(_states)
+            if kind == 'wind':
+                mag = rng.choice([0, 50, 52, 58, 65, 70, 80])
+                extra = {'mt': rng.choice(['MG', 'EG', 'MS', 'ES', ''])}
+            else:
+                mag = rng.choice([0.75, 1.0, 1.75, 2.5, 4.0])
+                extra = {'fc': 0}
+            track = (30 + rng.random() * 8, -100 + rng.random() * 10, 0, 0)
+            rows.append(_row(rng, _random_time(rng), st, stf, [rng.choice(ctys)], mag, track, (0, 0, 0), om, extra))
+
+    lines = [ ",".join(cols) ] + [ ",".join(str(row[col]) for col in cols) for row in rows ]
+    return "\n".join(lines) + "\n"
+
+
+def _normalize(val):
+    if isinstance(val, float) and math.isnan(val):
+        return None
+    elif isinstance(val, np.generic):
+        return _normalize(val.item())
+    elif isinstance(val, datetime):
+        return val.isoformat()
+    elif isinstance(val, (list, tuple)):
+        return tuple(_normalize(v) for v in val)
+    return val
+
+
+def _canonical(svr_list):
+    # Each event as a string, so results can be compared regardless of order
+    unpacker = type(svr_list).unpacker
+    items = []
+    for svr in svr_list:
+        reports, _ = unpacker.disassemble(svr)
+        items.append(repr([ sorted((k, _normalize(v)) for k, v in rep._attrs.items() if k not in _csv_attrs) for rep in reports ]))
+    return Counter(items)
+
+
+def _compare(expected, actual):
+    missing = expected - actual
+    extra = actual - expected
+    if len(missing) == 0 and len(extra) == 0:
+        return None
+    return "%d expected events missing, %d unexpected events (e.g. %s)" % (sum(missing.values()), sum(extra.values()),
+                                                                          next(iter(missing or extra))[:200])
+
+
+def _error(exc):
+    # A fast path that raises where the reference doesn't is a divergence too
+    return "Raised %s: %s" % (type(exc).__name__, exc)
+
+
+def _reference_search(svr_list, keys):
+    # Counties are looked up by name here rather than with the cached lookup the database objects use
+    keys = dict(keys)
+    if 'county' in keys:
+        counties = keys.pop('county')
+        if len(counties) > 0 and not isinstance(counties[0], (list, tuple)):
+            counties = [ counties ]
+
+        codes = []
+        for name, st in counties:
+            entry = fips.lookup_name(name, st)
+            codes.append(entry['state_fips'] * 1000 + entry['county_fips'])
+        keys['cty_fips'] = codes
+
+    return Searchable.search(svr_list, **keys)
+
+
+def _random_query(rng, svr_list, kind):
+    # A random search for values that are (mostly) in the database, and a description of it
+    svrs = list(svr_list)
+    sample = rng.choice(svrs)
+
+    def states():
+        st = sample['st']
+        st = rng.choice(st) if isinstance(st, list) else st
+        if rng.random() < 0.3:
+            return [ st, rng.choice(_states)[0] ], None
+        return st, None
+
+    def mags():
+        mag = sample['mag']
+        if rng.random() < 0.3:
+            return (lambda m: m >= mag), "lambda m: m >= %r" % mag
+        return mag, None
+
+    def counties():
+        cty_fips = sample['cty_fips']
+        codes = cty_fips if isinstance(cty_fips, list) else [ cty_fips ]
+
+        # Only tornadoes get their old county codes corrected, so some codes aren't in the FIPS table
+        entries = []
+        for code in codes:
+            try:
+                entries.append(fips.lookup_fips(code))
+            except IndexError:
+                pass
+
+        if len(entries) == 0:
+            return [ ('Cleveland', 'OK') ], None
+        entry = rng.choice(entries)
+        return (entry['county'], entry['state']), None
+
+    def times():
+        dt = sample['datetime']
+        choice = rng.randint(0, 4)
+        if choice == 0:
+            years = rng.sample(range(2004, 2011), rng.randint(1, 2))
+            return byyear(*years), "byyear(%s)" % ", ".join(map(str, years))
+        elif choice == 1:
+            return bymonth(dt.month), "bymonth(%d)" % dt.month
+        elif choice == 2:
+            return bycday(dt), "bycday(%r)" % dt
+        elif choice == 3:
+            return byhour(dt.hour), "byhour(%d)" % dt.hour
+
+        # Time ranges that start or end exactly on an event
+        other = rng.choice(svrs)['datetime']
+        start, end = min(dt, other), max(dt, other)
+        return bytime(start, end), "bytime(%r, %r)" % (start, end)
+
+    def injuries():
+        inj = rng.choice([0, 1, 3])
+        return (lambda i: i >= inj), "lambda i: i >= %d" % inj
+
+    def scalar(col):
+        def get():
+            return sample[col], None
+        return get
+
+    generators = {'state': states, 'mag': mags, 'county': counties, 'datetime': times, 'injuries': injuries}
+    if kind in ('tornado', 'segment'):
+        generators.update({'mag_code': scalar('mag_code'), 'is_ef': scalar('is_ef')})
+    elif kind == 'wind':
+        generators.update({'mag_code': scalar('mag_code'), 'mag_type': scalar('mag_type')})
+
+    keys = {}
+    desc = []
+    for col in rng.sample(sorted(generators.keys()), rng.randint(1, 3)):
+        val, val_desc = generators[col]()
+        keys[col] = val
+        desc.append("%s=%s" % (col, val_desc if val_desc is not None else repr(val)))
+
+    return keys, ", ".join(desc)
+
+
+_engines = OrderedDict()
+
+def register_engine(name, prepare):
+    # prepare(svr_list, workdir, cleanup) is called once per dataset and returns a function that does a search;
+    # cleanup is an ExitStack for anything that has to be closed afterward
+    _engines[name] = prepare
+
+
+def _indexed(svr_list, workdir, cleanup):
+    return lambda keys: svr_list.search(**keys)
+
+
+def _cached(svr_list, workdir, cleanup):
+    cached = type(svr_list)(*svr_list)
+    cached.enable_cache()
+
+    def search(keys):
+        # Search twice so the second one comes from the cache
+        cached.search(**keys)
+        return cached.search(**keys)
+    return search
+
+
+def _query(svr_list, workdir, cleanup):
+    def search(keys):
+        query = svr_list.query()
+        for col, val in keys.items():
+            query = query.search(**{col: val})
+        return query.collect()
+    return search
+
+
+def _unsorted(svr_list, workdir, cleanup):
+    # Out of time order, so searches have to use the sorted time index
+    svrs = list(svr_list)
+    random.Random(len(svrs)).shuffle(svrs)
+    shuffled = type(svr_list)(*svrs)
+    return lambda keys: shuffled.search(**keys)
+
+
+def _columnar(svr_list, workdir, cleanup):
+    fname = os.path.join(workdir, 'columnar.svrc')
+    svr_list.to_columnar(fname)
+    loaded = type(svr_list).from_columnar(fname)
+    return lambda keys: loaded.search(**keys)
+
+
+def _shared_memory(svr_list, workdir, cleanup):
+    shared = svr_list.publish()
+    cleanup.callback(shared.unlink)
+    cleanup.callback(shared.close)
+
+    attached = type(svr_list).attach(shared.name)
+    return lambda keys: attached.search(**keys)
+
+
+def _partitioned(svr_list, workdir, cleanup):
+    # A small memory limit, so the partitions get split into chunks, and half the events added afterward, so the
+    # partitions have more than one segment
+    pdb = PartitionedDB.create(os.path.join(workdir, 'partitioned'), svr_list._subset(np.arange(0, len(svr_list), 2)),
+                               max_bytes=64 * 1024)
+    pdb.append(svr_list._subset(np.arange(1, len(svr_list), 2)))
+    return lambda keys: pdb.search(**keys)
+
+
+register_engine('indexed', _indexed)
+register_engine('cached', _cached)
+register_engine('query', _query)
+register_engine('unsorted', _unsorted)
+register_engine('columnar', _columnar)
+register_engine('shared_memory', _shared_memory)
+register_engine('partitioned', _partitioned)
+
+
+# The reference parser is a plain row-by-row copy of the original parsing code, kept separate from parsers.py so that
+#   changes to ReportUnpacker.parse(), the derived columns, or the merging of tornado segments are checked against
+#   something other than themselves.
+_ef_start = datetime(2007, 2, 1, 0)
+
+def _reference_timestamp(date, time, tz):
+    yr, mo, dy = date.split('-')
+    hr, mn, sc = time.split(':')
+    dt = datetime(int(yr), int(mo), int(dy), int(hr), int(mn), int(sc))
+    return (dt - _epoch).total_seconds() + (0 if tz == 9 else 6 * 3600)
+
+
+def _reference_derive(kind, row):
+    if kind == 'tornado':
+        is_ef = _epoch + timedelta(seconds=row['datetime']) >= _ef_start
+        row['is_ef'] = is_ef
+        row['mag_code'] = ('EF' if is_ef else 'F') + (str(row['mag']) if row['mag'] >= 0 else 'U')
+        row['mag_value'] = row['mag'] if row['mag'] >= 0 else None
+
+    elif kind == 'wind':
+        mt = row['mt'][:1] if isinstance(row['mt'], str) else None
+        row['mag_type'] = {'M': 1, 'E': 2}.get(mt, 0)
+        row['mag_code'] = ((mt or '') + str(int(row['mag']))) if row['mag'] > 0 else '--'
+        row['mag_value'] = row['mag'] if row['mag'] > 0 else None
+
+
+def _reference_merge_segs(seg, other):
+    seg_tup = (seg['ns'], seg['sn'], seg['sg'])
+    merged = seg if seg_tup in [(1, 1, 1), (2, 0, 1), (3, 0, 1)] or other['sg'] == -9 else other
+    merged._attrs['cty_fips'] = list(dict.fromkeys(seg['cty_fips'] + other['cty_fips']))
+    return merged
+
+
+def _reference_tornado(segments):
+    if len(segments) == 1:
+        return Tornado(segments)
+
+    states = []
+    for seg in segments:
+        if seg['st'] not in states:
+            states.append(seg['st'])
+
+    segs, state_segs = [], []
+    for st in states:
+        st_segs = [ seg for seg in segments if seg['st'] == st ]
+        if len(st_segs) == 1:
+            segs.append(st_segs[0])
+            state_segs.append(st_segs[0])
+            continue
+
+        state_seg = next((seg for seg in st_segs if seg['sn'] == 1), None)
+        merged = st_segs[0]
+        for seg in st_segs[1:]:
+            merged = _reference_merge_segs(merged, seg)
+        segs.append(merged)
+
+        if state_seg is None or state_seg is merged:
+            state_segs.append(merged)
+        else:
+            state_seg._attrs['cty_fips'] = list(dict.fromkeys(merged['cty_fips']))
+            state_segs.append(state_seg)
+    return Tornado(segs, state_segs)
+
+
+def _reference_merge(segments):
+    segs_om = OrderedDict()
+    for seg in segments:
+        segs_om.setdefault((seg['datetime'].year, seg['om']), []).append(seg)
+
+    patches = [
+        (1993, 74, {'st': 'NE', 'stf': 31, 'f1': 65, 'stn': 1, 'elat': 40.02, 'elon': -99.92}),
+        (2006, 80, {'st': 'IL', 'stf': 17, 'f1': 157, 'f2': 145, 'stn': 5, 'slat': 37.78, 'slon': -90.05}),
+    ]
+    for yr, om, patch in patches:
+        if (yr, om) in segs_om and not any(seg['st'] == patch['st'] for seg in segs_om[yr, om]):
+            attrs = dict(segs_om[yr, om][0])
+            attrs.update(patch)
+            segs_om[yr, om].append(TornadoSegment(**attrs))
+
+    return [ _reference_tornado(segs) for segs in segs_om.values() ]
+
+
+def reference_parse(kind, csv):
+    # One row at a time, with none of the fast paths, so there's nothing here to get wrong the same way
+    df = pd.read_csv(StringIO(csv), index_col=False, dtype={'mt': str})
+    df.sort_values(['date', 'time'], axis='index', inplace=True)
+
+    report_kind = 'tornado' if kind == 'segment' else kind
+    if report_kind != 'tornado':
+        df = df.drop(columns=['elat', 'elon', 'len', 'wid', 'ns', 'sn', 'sg', 'f2', 'f3', 'f4'])
+
+    df['datetime'] = df.apply(lambda row: _reference_timestamp(row['date'], row['time'], row['tz']), axis=1)
+    df = df.drop(columns=['date', 'time', 'tz', 'yr', 'mo', 'dy'])
+
+    report_cls = {'tornado': TornadoSegment, 'wind': Wind, 'hail': Hail}[report_kind]
+    def to_report(series):
+        row = dict(zip(series.index.values, series.values))
+        _reference_derive(report_kind, row)
+        return report_cls(**row)
+
+    reports = df.apply(to_report, axis=1).tolist()
+
+    svrs = _reference_merge(reports) if report_kind == 'tornado' else reports
+    svrs = sorted(svrs, key=lambda svr: svr['datetime'])
+    if kind == 'segment':
+        svrs = [ seg for tor in svrs for seg in tor._state_segs ]
+    return _list_classes[kind](*svrs)
+
+
+def _load(kind, csv):
+    return reference_parse(kind, csv)
+
+
+_parsers = OrderedDict()
+
+def register_parser(name, load):
+    # load(list_cls, fname) reads an SPC-format CSV file into a database object
+    _parsers[name] = load
+
+
+def _from_txt(list_cls, fname):
+    with open(fname) as fobj:
+        return list_cls.from_txt(fobj.read())
+
+
+def _from_fobj(list_cls, fname):
+    with open(fname, 'rb') as fobj:
+        return list_cls.from_fobj(fobj)
+
+
+def _compressed(list_cls, fname):
+    gz_fname = fname + '.gz'
+    with open(fname, 'rb') as fobj, gzip.open(gz_fname, 'wb') as gz_fobj:
+        gz_fobj.write(fobj.read())
+    return list_cls.from_csv(gz_fname)
+
+
+register_parser('from_txt', _from_txt)
+register_parser('from_fobj', _from_fobj)
+register_parser('compressed', _compressed)
+
+
+def _check_parse(kind, csv, reference, workdir):
+    list_cls = _list_classes[kind]
+    fname = os.path.join(workdir, 'data.csv')
+    with open(fname, 'w') as fobj:
+        fobj.write(csv)
+
+    expected = _canonical(reference)
+    divergences = []
+    for name, load in _parsers.items():
+        try:
+            detail = _compare(expected, _canonical(load(list_cls, fname)))
+        except Exception as exc:
+            detail = _error(exc)
+
+        if detail is not None:
+            divergences.append(Divergence('parse', kind, name, '', detail))
+    return divergences
+
+
+def _check_days(kind, reference):
+    # Convective days run from 12Z to 12Z
+    expected = defaultdict(Counter)
+    for svr in reference:
+        day = (svr['datetime'] - timedelta(hours=12)).date()
+        expected[day].update(_canonical(type(reference)(svr)))
+
+    actual = dict((day.date(), _canonical(svrs)) for day, svrs in reference.days().items())
+
+    divergences = []
+    if sorted(expected.keys()) != sorted(actual.keys()):
+        divergences.append(Divergence('days', kind, 'days', '', "Got %d days, expected %d" % (len(actual), len(expected))))
+    else:
+        for day, exp in expected.items():
+            detail = _compare(exp, actual[day])
+            if detail is not None:
+                divergences.append(Divergence('days', kind, 'days', str(day), detail))
+    return divergences
+
+
+def _aggregates(groups):
+    return dict((key, (len(grp), float(np.sum(np.array(grp['inj'], dtype=float))))) for key, grp in groups.items())
+
+
+def _check_groupby(kind, reference, pdb):
+    group_cols = ['mag', 'datetime.year', 'datetime.month']
+    if kind != 'tornado':
+        group_cols.append('st')
+    if kind != 'hail':
+        group_cols.append('mag_code')
+
+    divergences = []
+    for col in group_cols:
+        name, _, attr = col.partition('.')
+        expected = defaultdict(list)
+        for svr in reference:
+            key = svr[name] if attr == '' else getattr(svr[name], attr)
+            expected[key].append(svr)
+        expected_aggs = dict((key, (len(svrs), float(sum(svr['inj'] for svr in svrs)))) for key, svrs in expected.items())
+
+        engines = [
+            ('indexed', lambda: _aggregates(reference.groupby(col))),
+            ('query', lambda: _aggregates(reference.query().groupby(col).collect())),
+            ('partitioned', lambda: dict((key, (cnt, pdb.groupby(col, column='inj', op='sum')[key]))
+                                         for key, cnt in pdb.groupby(col).items())),
+        ]
+
+        for engine_name, engine in engines:
+            detail = None
+            try:
+                actual = engine()
+                if actual != expected_aggs:
+                    diff = sorted(set(actual.items()) ^ set(expected_aggs.items()), key=repr)[:3]
+                    detail = "Groups differ: %s" % (diff,)
+            except Exception as exc:
+                detail = _error(exc)
+
+            if detail is not None:
+                divergences.append(Divergence('groupby', kind, engine_name, col, detail))
+    return divergences
+
+
+def _records(svr_list):
+    # The reports for each event, keyed on the event, so events can be compared field by field
+    unpacker = type(svr_list).unpacker
+    records = {}
+    for svr in svr_list:
+        key = (_normalize(svr['om']), _normalize(svr['datetime']), _normalize(svr['st']))
+        reports, _ = unpacker.disassemble(svr)
+        records[key] = [ dict((k, _normalize(v)) for k, v in rep._attrs.items() if k not in _csv_attrs) for rep in reports ]
+    return records
+
+
+def _compare_records(expected, actual):
+    missing = [ key for key in expected if key not in actual ]
+    extra = [ key for key in actual if key not in expected ]
+
+    differ = []
+    for key in expected:
+        if key not in actual or actual[key] == expected[key]:
+            continue
+
+        exp_reps, act_reps = expected[key], actual[key]
+        if len(exp_reps) != len(act_reps):
+            differ.append("%s has %d reports, expected %d" % (key, len(act_reps), len(exp_reps)))
+            continue
+
+        for idx, (exp, act) in enumerate(zip(exp_reps, act_reps)):
+            fields = sorted(set(exp.keys()) | set(act.keys()))
+            bad = [ "%s=%r (expected %r)" % (f, act.get(f), exp.get(f)) for f in fields if act.get(f) != exp.get(f) ]
+            if len(bad) > 0:
+                differ.append("%s report %d: %s" % (key, idx, ", ".join(bad)))
+                break
+
+    if len(missing) == 0 and len(extra) == 0 and len(differ) == 0:
+        return None
+
+    example = (differ or [ "%s missing" % (key,) for key in missing ] or [ "%s unexpected" % (key,) for key in extra ])[0]
+    return "%d events differ, %d missing, %d unexpected (e.g. %s)" % (len(differ), len(missing), len(extra), example[:300])
+
+
+def _check_csv(kind, reference, searches, workdir):
+    # Write each engine's results out and read them back in, which has to give the reference events again
+    list_cls = _list_classes[kind]
+    expected = _records(reference)
+
+    divergences = []
+    for name, search in searches.items():
+        fname = os.path.join(workdir, 'round_trip_%s.csv' % name)
+        try:
+            search({}).to_csv(fname)
+            detail = _compare_records(expected, _records(list_cls.from_csv(fname)))
+        except Exception as exc:
+            detail = _error(exc)
+
+        if detail is not None:
+            divergences.append(Divergence('csv', kind, name, '', detail))
+    return divergences
+
+
+def verify(seed=0, n_datasets=2, n_reports=300, n_queries=40, kinds=None, engines=None, log=None):
+    # Returns the divergences (empty if everything matched). The same seed always makes the same datasets and searches.
+    kinds = list(_list_classes.keys()) if kinds is None else kinds
+    engines = list(_engines.keys()) if engines is None else engines
+    log = log if log is not None else (lambda msg: None)
+
+    divergences = []
+    for ids in range(n_datasets):
+        for kind in kinds:
+            ds_seed = seed * 1000 + ids
+            csv = generate_csv('tornado' if kind == 'segment' else kind, n_reports, seed=ds_seed)
+            reference = _load(kind, csv)
+            n_before = len(divergences)
+
+            with tempfile.TemporaryDirectory() as workdir, contextlib.ExitStack() as cleanup:
+                divergences.extend(_check_parse(kind, csv, reference, workdir))
+                divergences.extend(_check_days(kind, reference))
+
+                searches = OrderedDict()
+                for name in engines:
+                    engine_dir = os.path.join(workdir, name)
+                    os.makedirs(engine_dir)
+                    searches[name] = _engines[name](reference, engine_dir, cleanup)
+
+                rng = random.Random(ds_seed)
+                for _ in range(n_queries):
+                    keys, desc = _random_query(rng, reference, kind)
+                    expected = _canonical(_reference_search(reference, keys))
+                    for name, search in searches.items():
+                        try:
+                            detail = _compare(expected, _canonical(search(keys)))
+                        except Exception as exc:
+                            detail = _error(exc)
+                        if detail is not None:
+                            divergences.append(Divergence('search', kind, name, desc, detail))
+
+                pdb = PartitionedDB.create(os.path.join(workdir, 'groupby'), reference)
+                divergences.extend(_check_groupby(kind, reference, pdb))
+
+                if kind in ('tornado', 'segment'):
+                    # Only tornadoes can be written back out to CSV
+                    divergences.extend(_check_csv(kind, reference, searches, workdir))
+
+            log("%s dataset %d (seed %d): %d divergences" % (kind, ids, ds_seed, len(divergences) - n_before))
+
+    return divergences
+
+
+def format_divergences(divergences):
+    lines = []
+    for div in divergences:
+        case = " [%s]" % div.case if div.case != '' else ''
+        lines.append("%s/%s (%s)%s: %s" % (div.check, div.kind, div.engine, case, div.detail))
+    return "\n".join(lines)
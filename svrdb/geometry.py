@@ -0,0 +1,270 @@
+from .spatial import _gc_dist, _item_track
+from .climatology import _km_per_mile
+
+import os
+import json
+
+import numpy as np
+
+try:
+    import shapefile
+except ImportError:
+    _can_read_shp = False
+else:
+    _can_read_shp = True
+
+# Largest number of (track segment, polygon edge) pairs to work on at once
+_chunk_pairs = 2 ** 22
+_chunk_segs = 32
+
+# Height in degrees of the latitude bands used to group nearby track segments
+_band_size = 0.5
+
+class Region(object):
+    def __init__(self, rings, properties=None):
+        # Rings are (lon, lat) and filled with the even-odd rule, so holes and multipolygons need no special handling
+        edges = []
+        for ring in rings:
+            ring = np.asarray(ring, dtype=float)[:, :2]
+            if len(ring) == 0:
+                continue
+            if not np.array_equal(ring[0], ring[-1]):
+                ring = np.vstack([ring, ring[:1]])
+            edges.append(np.column_stack([ring[:-1], ring[1:]]))
+
+        if len(edges) == 0:
+            raise ValueError("Region must have at least one ring")
+
+        # Each edge is (lon0, lat0, lon1, lat1)
+        self.edges = np.concatenate(edges)
+        self.properties = properties if properties is not None else {}
+
+        lons = self.edges[:, [0, 2]]
+        lats = self.edges[:, [1, 3]]
+        self.bounds = (lons.min(), lats.min(), lons.max(), lats.max())
+
+    def __len__(self):
+        return len(self.edges)
+
+    def __repr__(self):
+        return "Region(%d edges, bounds=(%g, %g, %g, %g))" % ((len(self),) + self.bounds)
+
+    def _edges_near(self, lon_lb, lat_lb, lon_ub, lat_ub, rightward=False):
+        x0, y0, x1, y1 = self.edges.T
+        near = (np.maximum(y0, y1) >= lat_lb) & (np.minimum(y0, y1) <= lat_ub) & (np.maximum(x0, x1) >= lon_lb)
+        if not rightward:
+            # A ray cast to the east can cross edges anywhere to the east, but a segment can't
+            near &= np.minimum(x0, x1) <= lon_ub
+        return self.edges[near]
+
+    def contains(self, lats, lons):
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        shape = lats.shape
+        lats = lats.ravel()
+        lons = lons.ravel()
+
+        inside = np.zeros(len(lats), dtype=bool)
+        lon_lb, lat_lb, lon_ub, lat_ub = self.bounds
+        cand = np.flatnonzero((lats >= lat_lb) & (lats <= lat_ub) & (lons >= lon_lb) & (lons <= lon_ub))
+
+        chunk = max(1, _chunk_pairs // len(self))
+        for start in range(0, len(cand), chunk):
+            pts = cand[start:(start + chunk)]
+            inside[pts] = _even_odd(self._edges_near(lons[pts].min(), lats[pts].min(), lons[pts].max(), lats[pts].max(), rightward=True),
+                                    lats[pts], lons[pts])
+        return inside.reshape(shape)
+
+    def inside_fraction(self, slat, slon, elat, elon):
+        # Segments are straight lines in lat/lon, which is close enough to the great circle for tornado tracks
+        slat, slon, elat, elon = (np.asarray(a, dtype=float) for a in (slat, slon, elat, elon))
+        frac = np.zeros(len(slat))
+
+        lon_lb, lat_lb, lon_ub, lat_ub = self.bounds
+        cand = np.flatnonzero((np.maximum(slat, elat) >= lat_lb) & (np.minimum(slat, elat) <= lat_ub) &
+                              (np.maximum(slon, elon) >= lon_lb) & (np.minimum(slon, elon) <= lon_ub))
+
+        # Sorting by latitude band, then longitude, keeps each chunk of segments compact, so fewer edges need to be
+        #   checked against it
+        band = np.floor(np.minimum(slat, elat)[cand] / _band_size)
+        cand = cand[np.lexsort((np.minimum(slon, elon)[cand], band))]
+
+        chunk = max(1, min(_chunk_segs, _chunk_pairs // len(self)))
+        for start in range(0, len(cand), chunk):
+            segs = cand[start:(start + chunk)]
+            seg_lats = np.concatenate([slat[segs], elat[segs]])
+            seg_lons = np.concatenate([slon[segs], elon[segs]])
+            bbox = (seg_lons.min(), seg_lats.min(), seg_lons.max(), seg_lats.max())
+
+            ray_edges = self._edges_near(*bbox, rightward=True)
+            frac[segs] = _inside_fraction(self._edges_near(*bbox), ray_edges, slat[segs], slon[segs], elat[segs], elon[segs])
+
+        return frac
+
+
+def _even_odd(edges, lats, lons):
+    x0, y0, x1, y1 = (e[np.newaxis, :] for e in edges.T)
+    py = lats[:, np.newaxis]
+    px = lons[:, np.newaxis]
+
+    straddles = (y0 > py) != (y1 > py)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_cross = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+
+    crossings = (straddles & (px < x_cross)).sum(axis=1)
+    return crossings % 2 == 1
+
+
+def _inside_fraction(edges, ray_edges, slat, slon, elat, elon):
+    starts_inside = _even_odd(ray_edges, slat, slon)
+    if len(edges) == 0:
+        return starts_inside.astype(float)
+
+    ax, ay = slon[:, np.newaxis], slat[:, np.newaxis]
+    rx, ry = (elon - slon)[:, np.newaxis], (elat - slat)[:, np.newaxis]
+    cx, cy, dx, dy = (e[np.newaxis, :] for e in edges.T)
+    sx, sy = dx - cx, dy - cy
+
+    # Where along each segment (t) and along each edge (u) the two cross
+    denom = rx * sy - ry * sx
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = ((cx - ax) * sy - (cy - ay) * sx) / denom
+        u = ((cx - ax) * ry - (cy - ay) * rx) / denom
+
+    hits = (denom != 0) & (t > 0) & (t < 1) & (u >= 0) & (u < 1)
+    rows, cols = np.nonzero(hits)
+    hit_t = t[rows, cols]
+    order = np.lexsort((hit_t, rows))
+    rows, hit_t = rows[order], hit_t[order]
+
+    # Split each segment into pieces at the crossings, with one more piece after the last crossing
+    n_hits = np.bincount(rows, minlength=len(slat))
+    row_start = np.cumsum(n_hits) - n_hits
+    piece_rows = np.concatenate([rows, np.arange(len(slat))])
+    piece_num = np.concatenate([np.arange(len(rows)) - row_start[rows], n_hits])
+    piece_ub = np.concatenate([hit_t, np.ones(len(slat))])
+
+    last_t = np.zeros(len(slat))
+    has_hits = n_hits > 0
+    last_t[has_hits] = hit_t[row_start[has_hits] + n_hits[has_hits] - 1]
+    prev_t = np.zeros(len(rows))
+    follows = piece_num[:len(rows)] > 0
+    prev_t[follows] = hit_t[np.flatnonzero(follows) - 1]
+    piece_lb = np.concatenate([prev_t, last_t])
+
+    # Every crossing flips between inside and outside, starting from whether the segment starts inside
+    inside = starts_inside[piece_rows] != (piece_num % 2 == 1)
+
+    # Crossings exactly at vertices or along edges can throw off the count, so check the middle of those pieces instead
+    ends_inside = _even_odd(ray_edges, elat, elon)
+    bad = ((starts_inside != ends_inside) != (n_hits % 2 == 1))[piece_rows]
+    if bad.any():
+        mid = (piece_lb[bad] + piece_ub[bad]) / 2
+        bad_rows = piece_rows[bad]
+        inside[bad] = _even_odd(ray_edges, slat[bad_rows] + mid * ry[bad_rows, 0], slon[bad_rows] + mid * rx[bad_rows, 0])
+
+    return np.bincount(piece_rows, weights=(piece_ub - piece_lb) * inside, minlength=len(slat))
+
+
+def _geojson_rings(geom):
+    if geom['type'] == 'Polygon':
+        return geom['coordinates']
+    elif geom['type'] == 'MultiPolygon':
+        return [ ring for poly in geom['coordinates'] for ring in poly ]
+    elif geom['type'] == 'GeometryCollection':
+        return [ ring for part in geom['geometries'] for ring in _geojson_rings(part) ]
+    raise ValueError("Can't make a region from a GeoJSON %s" % geom['type'])
+
+
+def _load_geojson(fname):
+    with open(fname) as fobj:
+        obj = json.load(fobj)
+
+    if obj['type'] == 'FeatureCollection':
+        features = obj['features']
+    elif obj['type'] == 'Feature':
+        features = [ obj ]
+    else:
+        features = [ {'geometry': obj, 'properties': {}} ]
+
+    return [ Region(_geojson_rings(feat['geometry']), properties=feat.get('properties') or {})
+             for feat in features if feat.get('geometry') is not None ]
+
+
+def _load_shapefile(fname):
+    if not _can_read_shp:
+        raise RuntimeError("Must have pyshp installed to read shapefiles")
+
+    regions = []
+    with shapefile.Reader(fname) as reader:
+        for shape_rec in reader.iterShapeRecords():
+            shape = shape_rec.shape
+            if len(shape.points) == 0:
+                continue
+
+            parts = list(shape.parts) + [ len(shape.points) ]
+            rings = [ shape.points[lb:ub] for lb, ub in zip(parts[:-1], parts[1:]) ]
+            regions.append(Region(rings, properties=shape_rec.record.as_dict()))
+    return regions
+
+
+def load_regions(fname, name_field=None):
+    # From GeoJSON or a shapefile. Returns a list of Regions, or a dict keyed by the name_field property.
+    ext = os.path.splitext(fname)[1].lower()
+    if ext in ('.json', '.geojson'):
+        regions = _load_geojson(fname)
+    elif ext in ('.shp', '.zip'):
+        regions = _load_shapefile(fname)
+    else:
+        raise ValueError("Don't know how to read regions from '%s' (expected GeoJSON or a shapefile)" % fname)
+
+    if name_field is None:
+        return regions
+    return dict((reg.properties[name_field], reg) for reg in regions)
+
+
+class TrackIndex(object):
+    def __init__(self, n_items, owners, slat, slon, elat, elon):
+        # Pieces are sorted by their western edge so a search for a region only has to look at a prefix of them
+        lon_lb = np.minimum(slon, elon)
+        order = np.argsort(lon_lb, kind='stable')
+
+        self.n_items = n_items
+        self.owners = np.asarray(owners, dtype=np.int64)[order]
+        self.slat, self.slon, self.elat, self.elon = (np.asarray(a, dtype=float)[order] for a in (slat, slon, elat, elon))
+        self.lon_lb = lon_lb[order]
+        self.lon_ub = np.maximum(self.slon, self.elon)
+        self.lat_lb = np.minimum(self.slat, self.elat)
+        self.lat_ub = np.maximum(self.slat, self.elat)
+        self.lengths = _gc_dist(self.slat, self.slon, self.elat, self.elon) / _km_per_mile
+
+    @classmethod
+    def from_list(cls, svr_list):
+        pieces = [ (idx,) + trk for idx, svr in enumerate(svr_list) for trk in _item_track(svr) ]
+        if len(pieces) == 0:
+            return cls(len(svr_list), *[ np.zeros(0) for _ in range(5) ])
+
+        return cls(len(svr_list), *[ np.array(col) for col in zip(*pieces) ])
+
+    def _candidates(self, region):
+        lon_lb, lat_lb, lon_ub, lat_ub = region.bounds
+        stop = np.searchsorted(self.lon_lb, lon_ub, side='right')
+        overlaps = (self.lon_ub[:stop] >= lon_lb) & (self.lat_ub[:stop] >= lat_lb) & (self.lat_lb[:stop] <= lat_ub)
+        return np.flatnonzero(overlaps)
+
+    def track_lengths(self):
+        return np.bincount(self.owners, weights=self.lengths, minlength=self.n_items)
+
+    def _inside_fraction(self, region):
+        cand = self._candidates(region)
+        frac = region.inside_fraction(self.slat[cand], self.slon[cand], self.elat[cand], self.elon[cand])
+        return cand, frac
+
+    def clipped_lengths(self, region):
+        cand, frac = self._inside_fraction(region)
+        return np.bincount(self.owners[cand], weights=frac * self.lengths[cand], minlength=self.n_items)
+
+    def crosses(self, region):
+        # Point reports and zero-length tracks have nothing to clip, but still count if they're inside
+        cand, frac = self._inside_fraction(region)
+        return np.bincount(self.owners[cand], weights=(frac > 0), minlength=self.n_items) > 0
@@ -1,15 +1,20 @@
 
 from .tornado import TornadoSegment, Tornado
-from .wind import Wind
+from .wind import Wind, MagType
 from .hail import Hail
+from .profiling import stage
 
 import pandas as pd
+import numpy as np
 
-from datetime import datetime, timedelta
+from datetime import datetime
 from collections import defaultdict
 
 _epoch = datetime(1970, 1, 1, 0)
 
+# Tornadoes were rated on the Enhanced Fujita scale starting 1 Feb 2007
+_ef_start = (datetime(2007, 2, 1, 0) - _epoch).total_seconds()
+
 class ReportUnpacker(object):
     def __init_subclass__(cls, report_primitive):
         super().__init_subclass__()
@@ -22,17 +27,29 @@ class ReportUnpacker(object):
             dt = datetime(int(yr), int(mo), int(dy), int(hr), int(mn), int(sc))
             return (dt - _epoch).total_seconds()
 
-        dts = [str_to_timestamp(d, t) for d, t in zip(df['date'], df['time'])]
-        tds = [0 if tz == 9 else 6 * 3600 for tz in df['tz']]
+        with stage('timestamps') as stg:
+            dts = [str_to_timestamp(d, t) for d, t in zip(df['date'], df['time'])]
+            tds = [0 if tz == 9 else 6 * 3600 for tz in df['tz']]
+
+            dt = pd.Series([dt + td for dt, td in zip(dts, tds)], index=df.index)
 
-        dt = pd.Series([dt + td for dt, td in zip(dts, tds)], index=df.index)
+            del df['date'], df['time'], df['tz'], df['yr'], df['mo'], df['dy']
+            df['datetime'] = dt
+            stg.rows = len(df)
 
-        del df['date'], df['time'], df['tz'], df['yr'], df['mo'], df['dy']
-        df['datetime'] = dt
+        with stage('derive') as stg:
+            self.derive(df)
+            stg.rows = len(df)
 
-        reports = df.apply(type(self).to_reports, axis=1)
+        with stage('build_reports') as stg:
+            reports = df.apply(type(self).to_reports, axis=1)
+            stg.rows = len(reports)
         return reports.tolist()
 
+    def derive(self, df):
+        # Columns computed from the others once for the whole database, so the reports don't have to work them out
+        pass
+
     def merge(self, svrs):
         return svrs
 
@@ -41,14 +58,52 @@ class ReportUnpacker(object):
         rep_dict = dict(zip(series.index.values, series.values))
         return cls.report_primitive(**rep_dict)
 
+    @classmethod
+    def from_attrs(cls, attrs):
+        # Rebuild a report from already-processed attributes, skipping the processing in __init__
+        report = cls.report_primitive.__new__(cls.report_primitive)
+        report._attrs = attrs
+        return report
+
+    @classmethod
+    def disassemble(cls, svr):
+        return [svr], []
+
+    @classmethod
+    def assemble(cls, reports, layout):
+        return reports[0]
+
+    @classmethod
+    def item_reducer(cls, name):
+        # How an item's value of a column comes from its reports' values: 'first', 'all' (a list), 'max', or
+        # 'argmax:<col>' (from the report with the largest <col>). None if it has to be worked out from the item.
+        return 'first'
+
+    @classmethod
+    def n_main_reports(cls, item_offsets, layout_vals, layout_offsets):
+        # Number of reports at the start of each item that its values come from
+        return np.diff(item_offsets)
+
 
 class TornadoUnpacker(ReportUnpacker, report_primitive=TornadoSegment):
+    def derive(self, df):
+        is_ef = df['datetime'] >= _ef_start
+        is_known = df['mag'] >= 0
+
+        df['is_ef'] = is_ef
+        df['mag_code'] = np.where(is_ef, 'EF', 'F') + np.where(is_known, df['mag'].astype(str), 'U').astype(object)
+        df['mag_value'] = df['mag'].astype(object).where(is_known, None)
+
     def merge(self, segments):
         segs_om = defaultdict(list)
         for seg in segments:
             segs_om[seg['datetime'].year, seg['om']].append(seg)
 
         def patch_seg(yr, om, patch):
+            # Files written by to_csv() already have the patched segment, and might not have the tornado at all
+            if (yr, om) not in segs_om or any(seg['st'] == patch['st'] for seg in segs_om[yr, om]):
+                return
+
             seg = dict(segs_om[yr, om][0])
             seg.update(patch)
             segs_om[yr, om].append(TornadoSegment(**seg))
@@ -56,15 +111,78 @@ class TornadoUnpacker(ReportUnpacker, report_primitive=TornadoSegment):
         patch_seg(1993, 74, {'st':'NE', 'stf':31, 'f1':65, 'stn':1, 'elat':40.02, 'elon':-99.92})
         patch_seg(2006, 80, {'st':'IL', 'stf':17, 'f1':157, 'f2':145, 'stn':5, 'slat':37.78, 'slon':-90.05})
 
-        tors = [ Tornado.from_segments(segs) for segs in segs_om.values() ]
+        with stage('segments') as stg:
+            tors = [ Tornado.from_segments(segs) for segs in segs_om.values() ]
+            stg.rows = len(segments)
         return tors
 
+    @classmethod
+    def disassemble(cls, tor):
+        # The layout is the number of segments, then the position of each state segment in the list of reports
+        reports = list(tor._segs)
+        layout = [len(reports)]
+        for seg in tor._state_segs:
+            try:
+                layout.append(next(idx for idx, rep in enumerate(reports) if rep is seg))
+            except StopIteration:
+                layout.append(len(reports))
+                reports.append(seg)
+        return reports, layout
+
+    @classmethod
+    def assemble(cls, reports, layout):
+        n_segs = layout[0]
+        return Tornado(reports[:n_segs], [ reports[idx] for idx in layout[1:] ])
+
+    # These have to match Tornado.__getitem__()
+    _item_reducers = {'st': 'all', 'cty_fips': 'all', 'mag': 'max', 'is_ef': 'first', 'mag_code': 'argmax:mag'}
+
+    @classmethod
+    def item_reducer(cls, name):
+        return cls._item_reducers.get(name)
+
+    @classmethod
+    def n_main_reports(cls, item_offsets, layout_vals, layout_offsets):
+        return layout_vals[layout_offsets[:-1]]
+
+class SegmentUnpacker(TornadoUnpacker, report_primitive=TornadoSegment):
+    def merge(self, segments):
+        tors = super(SegmentUnpacker, self).merge(segments)
+        return [ seg for tor in tors for seg in tor._state_segs ]
+
+    @classmethod
+    def disassemble(cls, seg):
+        return [seg], []
+
+    @classmethod
+    def assemble(cls, reports, layout):
+        return reports[0]
+
+    @classmethod
+    def item_reducer(cls, name):
+        return 'first'
+
+    @classmethod
+    def n_main_reports(cls, item_offsets, layout_vals, layout_offsets):
+        return np.diff(item_offsets)
+
+_wind_mag_types = {'M': MagType.MEASURED, 'E': MagType.ESTIMATED}
+
 class WindUnpacker(ReportUnpacker, report_primitive=Wind):
     def parse(self, df):
         del df['elat'], df['elon'], df['len'], df['wid'], df['ns'], df['sn'], df['sg'], df['f2'], df['f3'], df['f4']
 
         return super(WindUnpacker, self).parse(df)
 
+    def derive(self, df):
+        # The first letter of the magnitude type says whether the wind was measured or estimated
+        mag_type = df['mt'].str[:1]
+        is_known = df['mag'] > 0
+
+        df['mag_type'] = mag_type.map(dict((key, int(mt)) for key, mt in _wind_mag_types.items())).fillna(int(MagType.UNKNOWN)).astype(int)
+        df['mag_code'] = (mag_type.fillna('') + df['mag'].astype(int).astype(str)).where(is_known, '--')
+        df['mag_value'] = df['mag'].astype(object).where(is_known, None)
+
 class HailUnpacker(ReportUnpacker, report_primitive=Hail):
     def parse(self, df):
         del df['elat'], df['elon'], df['len'], df['wid'], df['ns'], df['sn'], df['sg'], df['f2'], df['f3'], df['f4']
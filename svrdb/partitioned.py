@@ -0,0 +1,226 @@
+from .searchable import _to_set, _timestamp_ceil
+from .profiling import stage
+from . import columnar
+
+import os
+import sys
+import json
+from collections import OrderedDict
+
+import numpy as np
+
+_manifest_fname = 'manifest.json'
+
+# Number of events to look at to estimate how much memory each one takes once it's built
+_n_sample = 16
+
+def _convective_years(timestamps):
+    # Partitions are convective years (12Z 1 Jan to 12Z 1 Jan), the same as byyear()
+    return (np.asarray(timestamps, dtype=np.int64) - 12 * 3600).astype('datetime64[s]').astype('datetime64[Y]').astype(np.int64) + 1970
+
+
+def _item_nbytes(unpacker, svr):
+    reports, _ = unpacker.disassemble(svr)
+    return sys.getsizeof(svr) + sum(sys.getsizeof(rep._attrs) + sum(sys.getsizeof(v) for v in rep._attrs.values()) for rep in reports)
+
+
+def _list_classes():
+    from .svrlist import TornadoList, SegmentList, WindList, HailList
+    return dict((cls.__name__, cls) for cls in [ TornadoList, SegmentList, WindList, HailList ])
+
+
+class _Aggregate(object):
+    # Partial aggregates that can be combined across partitions
+    def __init__(self, op):
+        if op not in ('count', 'sum', 'mean', 'min', 'max'):
+            raise ValueError("Unknown aggregation '%s'" % op)
+
+        self.op = op
+        self.count = 0
+        self.n_valid = 0
+        self.total = 0.
+        self.value = None
+
+    def add(self, vals):
+        # Missing values (e.g. unknown magnitudes) are counted, but otherwise left out
+        vals = np.asarray(vals, dtype=float)
+        self.count += len(vals)
+        vals = vals[~np.isnan(vals)]
+        self.n_valid += len(vals)
+        if self.op in ('sum', 'mean'):
+            self.total += vals.sum()
+        elif len(vals) > 0:
+            part = vals.min() if self.op == 'min' else vals.max()
+            self.value = part if self.value is None else (min(self.value, part) if self.op == 'min' else max(self.value, part))
+
+    def result(self):
+        if self.op == 'count':
+            return self.count
+        elif self.op == 'sum':
+            return float(self.total)
+        elif self.op == 'mean':
+            return float(self.total / self.n_valid) if self.n_valid > 0 else None
+        return None if self.value is None else float(self.value)
+
+
+class PartitionedDB(object):
+    def __init__(self, directory, max_bytes=256 * 1024 ** 2):
+        # max_bytes is roughly how much memory the events can take up while searching or grouping
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        with open(os.path.join(directory, _manifest_fname)) as fobj:
+            manifest = json.load(fobj)
+
+        self.list_cls = _list_classes()[manifest['list_cls']]
+        self._partitions = OrderedDict((int(year), part) for year, part in sorted(manifest['partitions'].items(), key=lambda p: int(p[0])))
+
+    @classmethod
+    def create(cls, directory, svr_list, max_bytes=256 * 1024 ** 2):
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(os.path.join(directory, _manifest_fname)):
+            raise ValueError("There's already a partitioned database in %s" % directory)
+
+        manifest = {'list_cls': type(svr_list).__name__, 'partitions': {}}
+        cls._write_manifest(directory, manifest)
+
+        pdb = cls(directory, max_bytes=max_bytes)
+        pdb.append(svr_list)
+        return pdb
+
+    @staticmethod
+    def _write_manifest(directory, manifest):
+        tmp_fname = os.path.join(directory, _manifest_fname + '.tmp')
+        with open(tmp_fname, 'w') as fobj:
+            json.dump(manifest, fobj, indent=1)
+        os.replace(tmp_fname, os.path.join(directory, _manifest_fname))
+
+    def _load_segments(self, year):
+        # Each append adds a file to the partition, so a partition is one or more segments
+        for fname in self._partitions[year]['fnames']:
+            yield columnar.load(self.list_cls, os.path.join(self.directory, fname))
+
+    def append(self, svr_list):
+        # The events are written to new segments of the partitions for their years, so the events already there
+        # never have to be loaded
+        if type(svr_list) is not self.list_cls:
+            raise ValueError("Can't add a %s to a partitioned %s" % (type(svr_list).__name__, self.list_cls.__name__))
+
+        with stage('append_partitions', db=self.list_cls.__name__) as stg:
+            svr_list = svr_list._time_sorted()
+            years = _convective_years(svr_list._timestamps())
+
+            for year in np.unique(years):
+                year = int(year)
+                part_list = svr_list._subset(np.flatnonzero(years == year))
+                part = self._partitions.get(year, {'fnames': [], 'n_items': 0, 'time_range': None, 'states': []})
+
+                states = set(part['states'])
+                for st in part_list['st']:
+                    states.update(_to_set(st))
+
+                timestamps = part_list._timestamps()
+                time_range = [ int(timestamps.min()), int(timestamps.max()) ]
+                if part['time_range'] is not None:
+                    time_range = [ min(time_range[0], part['time_range'][0]), max(time_range[1], part['time_range'][1]) ]
+
+                # Write to a temporary file first, so a failed write doesn't leave a partial segment behind
+                fname = "%d.%d.svrc" % (year, len(part['fnames']))
+                tmp_fname = os.path.join(self.directory, fname + '.tmp')
+                columnar.save(part_list, tmp_fname)
+                os.replace(tmp_fname, os.path.join(self.directory, fname))
+
+                self._partitions[year] = {
+                    'fnames': part['fnames'] + [ fname ],
+                    'n_items': part['n_items'] + len(part_list),
+                    'time_range': time_range,
+                    'states': sorted(states),
+                }
+
+            self._partitions = OrderedDict(sorted(self._partitions.items()))
+            manifest = {'list_cls': self.list_cls.__name__, 'partitions': dict((str(yr), part) for yr, part in self._partitions.items())}
+            self._write_manifest(self.directory, manifest)
+            stg.rows = len(svr_list)
+
+    @property
+    def years(self):
+        return list(self._partitions.keys())
+
+    def __len__(self):
+        return sum(part['n_items'] for part in self._partitions.values())
+
+    def _prune(self, conditions):
+        years = []
+        for year, part in self._partitions.items():
+            keep = True
+            for key, val in conditions:
+                if key == 'datetime' and getattr(val, 'ranges', None) is not None:
+                    tmin, tmax = part['time_range']
+                    keep &= any(_timestamp_ceil(start) <= tmax and _timestamp_ceil(end) > tmin for start, end in val.ranges)
+                elif key in ('st', 'state', 'datetime.year') and not callable(val):
+                    vals = _to_set(val)
+                    if not any(callable(v) for v in vals):
+                        keep &= len(vals & (set(part['states']) if key != 'datetime.year' else {year})) > 0
+            if keep:
+                years.append(year)
+        return years
+
+    def _scan(self, conditions):
+        # Chunks of the matching events, each small enough to fit in max_bytes
+        for year in self._prune(conditions):
+            for part_list in self._load_segments(year):
+                for chunk in self._scan_segment(part_list, conditions):
+                    yield year, chunk
+
+    def _scan_segment(self, part_list, conditions):
+        # Narrow the segment down with the time conditions, which only need the time column
+        time_conds = [ (key, val) for key, val in conditions if key == 'datetime' and getattr(val, 'ranges', None) is not None ]
+        positions = np.arange(len(part_list))[part_list._search_positions(time_conds)]
+        if len(positions) == 0:
+            return
+
+        sample = [ part_list._lst._build(pos) for pos in positions[:_n_sample] ]
+        item_bytes = np.mean([ _item_nbytes(self.list_cls.unpacker, svr) for svr in sample ])
+        chunk_size = max(1, int(self.max_bytes // max(item_bytes, 1)))
+
+        for start in range(0, len(positions), chunk_size):
+            chunk = self.list_cls(*[ part_list._lst._build(pos) for pos in positions[start:(start + chunk_size)] ])
+            chunk._indexes['time_order'] = None
+            yield chunk._search(list(conditions))
+
+    def iter_search(self, **keys):
+        # One database object per chunk of the results
+        for _, chunk in self._scan(list(keys.items())):
+            if len(chunk) > 0:
+                yield chunk
+
+    def search(self, **keys):
+        # All the results in one in-memory database object
+        with stage('search_partitions', db=self.list_cls.__name__) as stg:
+            svrs = [ svr for chunk in self.iter_search(**keys) for svr in chunk ]
+
+            # Segments added later can have events from earlier in the year
+            result = self.list_cls(*svrs)._time_sorted()
+            stg.rows = len(self)
+        return result
+
+    def groupby(self, group, column=None, op='count', search=None):
+        # `op` ('count', 'sum', 'mean', 'min', or 'max') on `column` for each group, after the optional search
+        groups = {}
+        with stage('groupby_partitions', db=self.list_cls.__name__) as stg:
+            for _, chunk in self._scan(list((search or {}).items())):
+                for key, grp in chunk.groupby(group).items():
+                    if key not in groups:
+                        groups[key] = _Aggregate(op)
+                    groups[key].add(np.ones(len(grp)) if column is None else grp[column])
+            stg.rows = len(self)
+
+        return dict((key, groups[key].result()) for key in sorted(groups.keys(), key=lambda k: (k is None, k)))
+
+    def aggregate(self, column=None, op='count', search=None):
+        agg = _Aggregate(op)
+        with stage('aggregate_partitions', db=self.list_cls.__name__) as stg:
+            for _, chunk in self._scan(list((search or {}).items())):
+                agg.add(np.ones(len(chunk)) if column is None else chunk[column])
+            stg.rows = len(self)
+        return agg.result()
@@ -1,6 +1,6 @@
 
 
-from datetime import datetime, timedelta
+from datetime import timedelta
 import copy
 import warnings
 
@@ -115,7 +115,7 @@ def map_background(plotter):
 @map_background
 def plot_tornadoes(ax, tor_list, label=None):
     label_conv = copy.copy(_label_conv)
-    label_conv['mag'] = lambda t: "EF%d" % t['mag'] if t['datetime'] >= datetime(2007, 2, 1, 0) else "F%d" % t['mag']
+    label_conv['mag'] = lambda t: t['mag_code']
 
     try:
         label_str = label_conv[label]
@@ -192,7 +192,7 @@ def plot_hail(ax, hail_list, label=None):
 @map_background
 def plot_wind(ax, wind_list, label=None):
     label_conv = copy.copy(_label_conv)
-    label_conv['mag'] = lambda w: "%s%d" % ((w['mt'][0] if type(w['mt']) != float else ''), w['mag'])
+    label_conv['mag'] = lambda w: w['mag_code']
 
     try:
         label_str = label_conv[label]
@@ -0,0 +1,209 @@
+import os
+import time
+import threading
+import warnings
+import tracemalloc
+from collections import OrderedDict, deque
+
+_enabled = False
+_trace_memory = False
+_started_tracemalloc = False
+_hooks = []
+
+# Only the latest stages are kept, so a long-running process doesn't keep growing. The report covers all of them.
+_max_records = 10000
+_records = deque(maxlen=_max_records)
+_summary = OrderedDict()
+
+# Hooks that were passed to instrument(), which are removed when it's turned off
+_session_hooks = []
+_lock = threading.Lock()
+_local = threading.local()
+
+class _NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, attr, val):
+        pass
+
+_null_stage = _NullStage()
+
+
+class _Stage(object):
+    def __init__(self, name, info):
+        self.name = name
+        self.info = info
+        self.rows = None
+
+    def __enter__(self):
+        try:
+            stack = _local.stack
+        except AttributeError:
+            stack = _local.stack = []
+
+        self._parent = stack[-1] if len(stack) > 0 else None
+        self.path = self.name if self._parent is None else "%s/%s" % (self._parent.path, self.name)
+        stack.append(self)
+
+        if _trace_memory and tracemalloc.is_tracing():
+            # Peak memory is global, so remember the parent's peak before resetting it for this stage
+            current, peak = tracemalloc.get_traced_memory()
+            if self._parent is not None:
+                self._parent._peak = max(self._parent._peak, peak)
+            tracemalloc.reset_peak()
+            self._start_mem = current
+            self._peak = current
+        else:
+            self._start_mem = None
+
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self._start
+
+        peak_bytes = None
+        if self._start_mem is not None and tracemalloc.is_tracing():
+            _, peak = tracemalloc.get_traced_memory()
+            self._peak = max(self._peak, peak)
+            peak_bytes = self._peak - self._start_mem
+            if self._parent is not None:
+                self._parent._peak = max(self._parent._peak, self._peak)
+
+        _local.stack.pop()
+
+        record = {
+            'stage': self.path,
+            'seconds': elapsed,
+            'rows': self.rows,
+            'peak_bytes': peak_bytes,
+            'thread': threading.current_thread().name,
+        }
+        record.update(self.info)
+
+        with _lock:
+            _records.append(record)
+            _add_to_summary(record)
+            hooks = list(_hooks)
+
+        # Profiling should never break whatever is being profiled
+        for hook in hooks:
+            try:
+                hook(record)
+            except Exception as exc:
+                warnings.warn("Profiling hook %r raised %s: %s" % (hook, type(exc).__name__, exc), RuntimeWarning)
+        return False
+
+
+def _add_to_summary(record):
+    summary = _summary.setdefault(record['stage'], {'calls': 0, 'seconds': 0., 'rows': None, 'peak_bytes': None})
+    summary['calls'] += 1
+    summary['seconds'] += record['seconds']
+    if record['rows'] is not None:
+        summary['rows'] = (summary['rows'] or 0) + record['rows']
+    if record['peak_bytes'] is not None:
+        summary['peak_bytes'] = max(summary['peak_bytes'] or 0, record['peak_bytes'])
+
+
+def stage(name, **info):
+    if not _enabled:
+        return _null_stage
+    return _Stage(name, info)
+
+
+class Instrumentation(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        disable()
+        return False
+
+    def records(self):
+        return records()
+
+    def report(self):
+        return report()
+
+    def format_report(self):
+        return format_report()
+
+
+def instrument(memory=False, hooks=None, max_records=_max_records):
+    global _enabled, _trace_memory, _started_tracemalloc, _records
+
+    # Each session starts fresh, without the stages or hooks from the last one
+    disable()
+    with _lock:
+        _records = deque(maxlen=max_records)
+    reset()
+
+    for hook in (hooks or []):
+        add_hook(hook)
+        _session_hooks.append(hook)
+
+    _trace_memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_tracemalloc = True
+
+    _enabled = True
+    return Instrumentation()
+
+
+def disable():
+    global _enabled, _trace_memory, _started_tracemalloc
+
+    _enabled = False
+    while len(_session_hooks) > 0:
+        remove_hook(_session_hooks.pop())
+
+    # Leave tracemalloc alone if something else started it
+    if _started_tracemalloc and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _started_tracemalloc = False
+    _trace_memory = False
+
+
+def add_hook(hook):
+    with _lock:
+        _hooks.append(hook)
+
+
+def remove_hook(hook):
+    with _lock:
+        _hooks.remove(hook)
+
+
+def records():
+    with _lock:
+        return list(_records)
+
+
+def reset():
+    with _lock:
+        _records.clear()
+        _summary.clear()
+
+
+def report():
+    with _lock:
+        return OrderedDict((name, dict(summary)) for name, summary in _summary.items())
+
+
+def format_report():
+    lines = ["%-40s %6s %10s %10s %12s" % ("Stage", "Calls", "Seconds", "Rows", "Peak (MB)")]
+    for name, summary in report().items():
+        rows = "" if summary['rows'] is None else "%d" % summary['rows']
+        peak = "" if summary['peak_bytes'] is None else "%.1f" % (summary['peak_bytes'] / 1024. ** 2)
+        lines.append("%-40s %6d %10.3f %10s %12s" % (name, summary['calls'], summary['seconds'], rows, peak))
+    return "\n".join(lines)
+
+
+# Setting SVRDB_INSTRUMENT turns on instrumentation at import ('memory' also tracks peak allocations)
+if os.environ.get('SVRDB_INSTRUMENT', '').lower() not in ('', '0', 'false', 'no'):
+    instrument(memory=os.environ['SVRDB_INSTRUMENT'].lower() == 'memory')
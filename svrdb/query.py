@@ -0,0 +1,45 @@
+from .searchable import bytime
+from .profiling import stage
+
+class Query(object):
+    def __init__(self, svr_list, conditions=(), group=None):
+        self._svr_list = svr_list
+        self._conditions = tuple(conditions)
+        self._group = group
+        self._result = None
+
+    def search(self, **keys):
+        return Query(self._svr_list, self._conditions + tuple(keys.items()), group=self._group)
+
+    def between(self, start, end):
+        return self.search(datetime=bytime(start, end))
+
+    def groupby(self, group):
+        return Query(self._svr_list, self._conditions, group=group)
+
+    def collect(self):
+        if self._result is not None:
+            return self._result
+
+        # All the searches are done in a single pass over the original list
+        svr_list = self._svr_list
+        with stage('query', db=type(svr_list).__name__) as stg:
+            if self._group is None:
+                self._result = svr_list._search(list(self._conditions))
+            else:
+                conditions = svr_list._resolve_conditions(self._conditions)
+                self._result = svr_list._groupby(self._group, positions=svr_list._search_positions(conditions))
+            stg.rows = len(svr_list)
+        return self._result
+
+    def __iter__(self):
+        return iter(self.collect())
+
+    def __len__(self):
+        return len(self.collect())
+
+    def __getitem__(self, key):
+        return self.collect()[key]
+
+    def __str__(self):
+        return str(self.collect())
@@ -59,10 +59,36 @@ class SearchableItem(object):
         return is_match
 
 
+_epoch = datetime(1970, 1, 1, 0)
+
+def _timestamp(dt):
+    return (dt - _epoch) // timedelta(seconds=1)
+
+
+def _timestamp_ceil(dt):
+    return -((_epoch - dt) // timedelta(seconds=1))
+
+
+class TimeFilter(object):
+    def __init__(self, matches, ranges=None, key=None):
+        self._matches = matches
+
+        # Contiguous [start, end) ranges of times the filter matches, if it can be expressed that way
+        self.ranges = ranges
+
+        # Hashable description of the filter, so equivalent filters can be recognized
+        self.key = key
+
+    def __call__(self, time):
+        return self._matches(time)
+
+
 def byyear(*years):
     def get_vals(time):
         return (time - timedelta(hours=12)).year in years
-    return get_vals
+
+    ranges = [ (datetime(yr, 1, 1, 12), datetime(yr + 1, 1, 1, 12)) for yr in years ]
+    return TimeFilter(get_vals, ranges=ranges, key=('byyear', frozenset(years)))
 
 
 def bymonth(*months):
@@ -83,7 +109,7 @@ def bymonth(*months):
 
     def get_vals(time):
         return (time - timedelta(hours=12)).month in month_nums
-    return get_vals
+    return TimeFilter(get_vals, key=('bymonth', frozenset(month_nums)))
 
 
 def bycday(*days):
@@ -92,10 +118,16 @@ def bycday(*days):
 
     def get_vals(time):
         return any(cds <= time < cde for cds, cde in zip(cday_starts, cday_ends))
-    return get_vals
+    return TimeFilter(get_vals, ranges=list(zip(cday_starts, cday_ends)), key=('bycday', frozenset(cday_starts)))
 
 
 def byhour(*hours):
     def get_vals(time):
         return time.hour in hours
-    return get_vals
+    return TimeFilter(get_vals, key=('byhour', frozenset(hours)))
+
+
+def bytime(start, end):
+    def get_vals(time):
+        return start <= time < end
+    return TimeFilter(get_vals, ranges=[(start, end)], key=('bytime', start, end))
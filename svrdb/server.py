@@ -0,0 +1,385 @@
+from .svrlist import TornadoList, WindList, HailList
+from .searchable import byyear, bymonth, bycday, byhour, bytime
+from .columnar import _published
+
+import asyncio
+import json
+import math
+import multiprocessing
+import operator
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+
+_db_classes = {
+    'tornado': TornadoList,
+    'wind': WindList,
+    'hail': HailList,
+}
+
+_record_cols = {
+    'tornado': ['datetime', 'st', 'mag', 'mag_code', 'inj', 'fat', 'loss', 'closs', 'slat', 'slon', 'elat', 'elon', 'len', 'wid', 'cty_fips'],
+    'wind': ['datetime', 'st', 'mag', 'mt', 'mag_type', 'mag_code', 'inj', 'fat', 'loss', 'closs', 'slat', 'slon', 'cty_fips'],
+    'hail': ['datetime', 'st', 'mag', 'inj', 'fat', 'loss', 'closs', 'slat', 'slon', 'cty_fips'],
+}
+
+_time_filters = {
+    'byyear': lambda args: byyear(*args),
+    'bymonth': lambda args: bymonth(*args),
+    'byhour': lambda args: byhour(*args),
+    'bycday': lambda args: bycday(*[ datetime.fromisoformat(a) for a in args ]),
+    'bytime': lambda args: bytime(*[ datetime.fromisoformat(a) for a in args ]),
+}
+
+_comparisons = {
+    'gt': operator.gt,
+    'ge': operator.ge,
+    'lt': operator.lt,
+    'le': operator.le,
+}
+
+_aggregates = {
+    'count': len,
+    'sum': np.sum,
+    'mean': np.mean,
+    'min': np.min,
+    'max': np.max,
+}
+
+_statuses = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    500: 'Internal Server Error',
+}
+
+# Number of reports to encode at a time when streaming search results
+_chunk_size = 1000
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+    def __reduce__(self):
+        # So errors can come back from worker processes
+        return (RequestError, (self.status, str(self)))
+
+
+class _StreamAborted(Exception):
+    pass
+
+
+# The server in each worker process, when searches run on processes
+_worker_server = None
+
+def _init_worker(shared_dbs, cache_size):
+    global _worker_server
+
+    # The workers share the server's resource tracker, so the server's entries for the memory have to stay there
+    _published.update(shm_name for _, _, shm_name in shared_dbs)
+    dbs = dict((name, list_cls.attach(shm_name)) for name, list_cls, shm_name in shared_dbs)
+    _worker_server = SVRServer(dbs=dbs, cache_size=cache_size)
+
+
+def _call_worker(method, *args):
+    return getattr(_worker_server, method)(*args)
+
+
+def _decode_value(col, val):
+    if col == 'county':
+        # Either a single ["County", "ST"] pair or a list of them
+        if all(isinstance(v, list) for v in val):
+            return [ tuple(v) for v in val ]
+        return tuple(val)
+
+    if not isinstance(val, dict):
+        return val
+
+    if len(val) == 1 and list(val.keys())[0] in _time_filters:
+        name, args = list(val.items())[0]
+        return _time_filters[name](args)
+
+    try:
+        comps = [ (_comparisons[op], bound) for op, bound in val.items() ]
+    except KeyError as exc:
+        raise RequestError(400, "Unknown search operator '%s'" % exc.args[0])
+
+    def compare(v):
+        return all(comp(v, bound) for comp, bound in comps)
+    return compare
+
+
+def _to_json(val):
+    if isinstance(val, datetime):
+        return val.isoformat()
+    elif isinstance(val, (list, tuple)):
+        return [ _to_json(v) for v in val ]
+    elif isinstance(val, np.generic):
+        val = val.item()
+
+    if isinstance(val, float) and math.isnan(val):
+        return None
+    return val
+
+
+class SVRServer(object):
+    def __init__(self, dbs=None, workers=None, cache_size=128, processes=False):
+        if dbs is None:
+            dbs = dict((name, cls.load_db()) for name, cls in _db_classes.items())
+
+        self.dbs = dbs
+        self._workers = workers
+        self._cache_size = cache_size
+        self._processes = processes
+        if cache_size > 0 and not processes:
+            for db in self.dbs.values():
+                db.enable_cache(maxsize=cache_size)
+
+        self._pool = None
+        self._shared = {}
+        self._server = None
+
+    def _start_pool(self):
+        # Searches are CPU-bound, so they run off the event loop to keep it responsive. Threads share the GIL, so
+        # searches on threads run one at a time; worker processes attach to the databases in shared memory instead.
+        if self._processes:
+            self._shared = dict((name, db.publish()) for name, db in self.dbs.items())
+            shared_dbs = [ (name, type(db), self._shared[name].name) for name, db in self.dbs.items() ]
+            # Forked workers would hold on to open client connections, and they get the databases from shared memory
+            # anyway
+            self._pool = ProcessPoolExecutor(max_workers=self._workers, mp_context=multiprocessing.get_context('spawn'),
+                                             initializer=_init_worker, initargs=(shared_dbs, self._cache_size))
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=self._workers)
+
+    async def _run(self, method, *args):
+        loop = asyncio.get_running_loop()
+        if self._processes:
+            return await loop.run_in_executor(self._pool, _call_worker, method, *args)
+        return await loop.run_in_executor(self._pool, getattr(self, method), *args)
+
+    def _get_conditions(self, request):
+        try:
+            db_name = request['db']
+            svr_list = self.dbs[db_name]
+        except KeyError:
+            raise RequestError(400, "Request must have 'db' set to one of %s" % ", ".join(sorted(self.dbs.keys())))
+
+        return db_name, [ (col, _decode_value(col, val)) for col, val in request.get('search', {}).items() ]
+
+    def _get_query(self, request):
+        db_name, conditions = self._get_conditions(request)
+        query = self.dbs[db_name].query()
+        for col, val in conditions:
+            query = query.search(**{col: val})
+        return db_name, query
+
+    def _get_page(self, request, n_results):
+        offset = request.get('offset', 0)
+        limit = request.get('limit')
+        for name, val in [ ('offset', offset), ('limit', limit) ]:
+            if val is not None and (type(val) is not int or val < 0):
+                raise RequestError(400, "'%s' must be a non-negative integer" % name)
+
+        stop = n_results if limit is None else offset + limit
+        return offset, stop
+
+    def _aggregate(self, svr_list, col, op):
+        try:
+            agg_func = _aggregates[op]
+        except KeyError:
+            raise RequestError(400, "Unknown aggregation '%s'" % op)
+
+        if op == 'count':
+            return len(svr_list)
+        if len(svr_list) == 0:
+            return None
+        return _to_json(agg_func(np.array(svr_list[col], dtype=float)))
+
+    def search(self, request):
+        db_name, query = self._get_query(request)
+        results = query.collect()
+
+        offset, stop = self._get_page(request, len(results))
+        return db_name, results[offset:stop]
+
+    def search_positions(self, request):
+        # Searches on worker processes send back the positions of the results in the database, since the events
+        # themselves would have to be pickled
+        db_name, conditions = self._get_conditions(request)
+        svr_list = self.dbs[db_name]
+        positions = np.arange(len(svr_list))[svr_list._search_positions(svr_list._resolve_conditions(conditions))]
+
+        offset, stop = self._get_page(request, len(positions))
+        return db_name, positions[offset:stop]
+
+    def encode_records(self, db_name, svrs):
+        cols = _record_cols.get(db_name, ['datetime', 'st', 'mag', 'slat', 'slon'])
+        return ",".join(json.dumps(dict((col, _to_json(svr[col])) for col in cols)) for svr in svrs)
+
+    def encode_positions(self, db_name, positions):
+        return self.encode_records(db_name, self.dbs[db_name]._subset(positions))
+
+    def groupby(self, request):
+        _, query = self._get_query(request)
+        try:
+            groups = query.groupby(request['groupby']).collect()
+        except KeyError:
+            raise RequestError(400, "Request must have 'groupby' set to a column")
+
+        agg = request.get('aggregate', {'op': 'count'})
+        return {'groups': [ [_to_json(key), self._aggregate(grp, agg.get('column'), agg['op'])] for key, grp in groups.items() ]}
+
+    def aggregate(self, request):
+        _, query = self._get_query(request)
+        return {'value': self._aggregate(query.collect(), request.get('column'), request.get('op', 'count'))}
+
+    def grid(self, request):
+        _, query = self._get_query(request)
+        if 'lat_edges' in request:
+            lat_edges = request['lat_edges']
+            lon_edges = request['lon_edges']
+        else:
+            lat_lb, lat_ub, lon_lb, lon_ub = request.get('bounds', [20, 55, -130, -60])
+            spacing = request.get('spacing', 1.)
+            lat_edges = np.arange(lat_lb, lat_ub + spacing / 2, spacing)
+            lon_edges = np.arange(lon_lb, lon_ub + spacing / 2, spacing)
+
+        grid = query.collect().to_grid(lat_edges, lon_edges)
+        return {'lat_edges': _to_json(list(lat_edges)), 'lon_edges': _to_json(list(lon_edges)), 'counts': grid.tolist()}
+
+    def databases(self, request):
+        return dict((name, len(db)) for name, db in self.dbs.items())
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        try:
+            method, path, _ = request_line.decode('ascii').split()
+        except ValueError:
+            raise RequestError(400, "Malformed request line")
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        body = await reader.readexactly(int(headers.get('content-length', 0)))
+        if len(body) > 0:
+            try:
+                body = json.loads(body)
+            except ValueError:
+                raise RequestError(400, "Request body must be JSON")
+        else:
+            body = {}
+
+        return method, path, body
+
+    async def _send_json(self, writer, status, obj):
+        body = json.dumps(obj).encode('utf-8')
+        writer.write(("HTTP/1.1 %d %s\r\n" % (status, _statuses[status])).encode('ascii'))
+        writer.write(b"Content-Type: application/json\r\nConnection: close\r\n")
+        writer.write(("Content-Length: %d\r\n\r\n" % len(body)).encode('ascii'))
+        writer.write(body)
+        await writer.drain()
+
+    async def _stream_search(self, writer, request):
+        if self._processes:
+            db_name, results = await self._run('search_positions', request)
+            encode = 'encode_positions'
+        else:
+            db_name, results = await self._run('search', request)
+            encode = 'encode_records'
+
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n")
+        writer.write(b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n")
+
+        def write_chunk(data):
+            data = data.encode('utf-8')
+            writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+        try:
+            write_chunk('{"count": %d, "results": [' % len(results))
+            for idx in range(0, len(results), _chunk_size):
+                chunk = await self._run(encode, db_name, results[idx:(idx + _chunk_size)])
+                write_chunk(("," if idx > 0 else "") + chunk)
+                await writer.drain()
+            write_chunk(']}')
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        except Exception as exc:
+            # The status line has already gone out, so the only way to signal an error is to close the connection
+            # without finishing the chunked body
+            raise _StreamAborted() from exc
+
+    async def _handle(self, reader, writer):
+        routes = {
+            ('GET', '/databases'): 'databases',
+            ('POST', '/groupby'): 'groupby',
+            ('POST', '/aggregate'): 'aggregate',
+            ('POST', '/grid'): 'grid',
+        }
+
+        try:
+            method, path, request = await self._read_request(reader)
+            if (method, path) == ('POST', '/search'):
+                await self._stream_search(writer, request)
+            elif (method, path) in routes:
+                response = await self._run(routes[method, path], request)
+                await self._send_json(writer, 200, response)
+            elif path in [ p for _, p in routes.keys() ] + ['/search']:
+                raise RequestError(405, "Method %s not allowed for %s" % (method, path))
+            else:
+                raise RequestError(404, "Unknown path %s" % path)
+        except _StreamAborted:
+            pass
+        except RequestError as exc:
+            await self._send_json(writer, exc.status, {'error': str(exc)})
+        except (KeyError, TypeError, ValueError) as exc:
+            await self._send_json(writer, 400, {'error': "%s: %s" % (type(exc).__name__, exc)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as exc:
+            await self._send_json(writer, 500, {'error': "%s: %s" % (type(exc).__name__, exc)})
+        finally:
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=8000):
+        self._start_pool()
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server
+
+    async def serve_forever(self, host='127.0.0.1', port=8000):
+        server = await self.start(host=host, port=port)
+        for sock in server.sockets:
+            print("Serving on http://%s:%d" % sock.getsockname()[:2])
+
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+        if self._pool is not None:
+            self._pool.shutdown(wait=self._processes)
+            self._pool = None
+
+        for shared in self._shared.values():
+            shared.close()
+            shared.unlink()
+        self._shared = {}
+
+
+def serve(host='127.0.0.1', port=8000, dbs=None, workers=None, cache_size=128, processes=False):
+    server = SVRServer(dbs=dbs, workers=workers, cache_size=cache_size, processes=processes)
+    try:
+        asyncio.run(server.serve_forever(host=host, port=port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
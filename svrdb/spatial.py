@@ -0,0 +1,178 @@
+from .searchable import _timestamp
+
+import numpy as np
+
+_earth_radius = 6371.
+
+def _gc_dist(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (np.radians(a) for a in (lat1, lon1, lat2, lon2))
+    hav = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * _earth_radius * np.arcsin(np.sqrt(np.clip(hav, 0, 1)))
+
+
+def _to_xyz(lats, lons):
+    lats = np.radians(lats)
+    lons = np.radians(lons)
+    return np.stack([
+        _earth_radius * np.cos(lats) * np.cos(lons),
+        _earth_radius * np.cos(lats) * np.sin(lons),
+        _earth_radius * np.sin(lats),
+    ], axis=-1)
+
+
+def _item_track(svr):
+    # Tornadoes are a polyline of state segments; wind and hail reports are a single point
+    try:
+        segs = svr._state_segs
+    except AttributeError:
+        segs = [svr]
+
+    track = []
+    for seg in segs:
+        try:
+            track.append((seg['slat'], seg['slon'], seg['elat'], seg['elon']))
+        except KeyError:
+            track.append((seg['slat'], seg['slon'], seg['slat'], seg['slon']))
+    return track
+
+
+def _track_points(svr_list, spacing):
+    pieces = []
+    for idx, svr in enumerate(svr_list):
+        time = _timestamp(svr['datetime'])
+        pieces.extend((idx, time) + trk for trk in _item_track(svr))
+
+    if len(pieces) == 0:
+        return [ np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0) ]
+
+    owner, time, slat, slon, elat, elon = (np.array(col) for col in zip(*pieces))
+
+    # Sample each track segment every `spacing` km so distances to the track are within spacing / 2
+    length = _gc_dist(slat, slon, elat, elon)
+    n_pts = np.where(length > 0, np.ceil(length / spacing).astype(np.int64) + 1, 1)
+    pt_piece = np.repeat(np.arange(len(n_pts)), n_pts)
+    pt_num = np.arange(len(pt_piece)) - np.repeat(np.cumsum(n_pts) - n_pts, n_pts)
+    frac = pt_num / np.maximum(n_pts[pt_piece] - 1, 1)
+
+    lats = slat[pt_piece] + frac * (elat - slat)[pt_piece]
+    lons = slon[pt_piece] + frac * (elon - slon)[pt_piece]
+    return owner[pt_piece], time[pt_piece], lats, lons
+
+
+def _searchsorted_within(values, lo, hi, targets, side='left'):
+    # np.searchsorted() for each target, but only in values[lo:hi] (which has to be sorted)
+    lo = lo.copy()
+    hi = hi.copy()
+    active = np.flatnonzero(lo < hi)
+    while len(active) > 0:
+        mid = (lo[active] + hi[active]) // 2
+        if side == 'left':
+            go_right = values[mid] < targets[active]
+        else:
+            go_right = values[mid] <= targets[active]
+
+        lo[active[go_right]] = mid[go_right] + 1
+        hi[active[~go_right]] = mid[~go_right]
+        active = active[lo[active] < hi[active]]
+    return lo
+
+
+class SpaceTimeIndex(object):
+    def __init__(self, owners, times, lats, lons):
+        self.owners = np.asarray(owners, dtype=np.int64)
+        self.times = np.asarray(times, dtype=np.int64)
+        self.xyz = _to_xyz(np.asarray(lats, dtype=float), np.asarray(lons, dtype=float))
+
+    @classmethod
+    def from_list(cls, svr_list, spacing):
+        return cls(*_track_points(svr_list, spacing))
+
+    def __len__(self):
+        return len(self.owners)
+
+    def pairs(self, other, km, minutes):
+        chord = 2 * _earth_radius * np.sin(km / (2 * _earth_radius))
+        seconds = int(minutes * 60)
+        if len(self) == 0 or len(other) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        # Bigger cells only mean more candidates to check, so keep them big enough that the packed cell keys for
+        # the whole globe fit in an int64
+        cell_size = max(chord, 2 * _earth_radius / 2 ** 20)
+        cells_self = np.floor(self.xyz / cell_size).astype(np.int64)
+        cells_other = np.floor(other.xyz / cell_size).astype(np.int64)
+
+        # Pack the 3-D cell coordinates into one integer key, leaving a cell of padding on each side
+        cell_lb = np.minimum(cells_self.min(axis=0), cells_other.min(axis=0)) - 1
+        cell_ub = np.maximum(cells_self.max(axis=0), cells_other.max(axis=0)) + 1
+        widths = cell_ub - cell_lb + 1
+
+        strides = np.array([widths[1] * widths[2], widths[2], 1], dtype=np.int64)
+        keys_self = (cells_self - cell_lb) @ strides
+        keys_other = (cells_other - cell_lb) @ strides
+
+        # Searching with sorted keys is much faster than with unsorted keys. The other points are sorted by time
+        # within each key, so the points close enough in time are a contiguous range.
+        order_self = np.argsort(keys_self, kind='stable')
+        keys_self = keys_self[order_self]
+        times_self = self.times[order_self]
+        order_other = np.lexsort((other.times, keys_other))
+        keys_other = keys_other[order_other]
+        times_other = other.times[order_other]
+
+        pair_self = []
+        pair_other = []
+        offsets = np.stack(np.meshgrid(*([[-1, 0, 1]] * 3), indexing='ij'), axis=-1).reshape(-1, 3)
+        for offset in offsets:
+            nbr_keys = keys_self + offset @ strides
+            key_lo = np.searchsorted(keys_other, nbr_keys, side='left')
+            key_hi = np.searchsorted(keys_other, nbr_keys, side='right')
+
+            lo = _searchsorted_within(times_other, key_lo, key_hi, times_self - seconds, side='left')
+            hi = _searchsorted_within(times_other, key_lo, key_hi, times_self + seconds, side='right')
+            counts = hi - lo
+            if counts.sum() == 0:
+                continue
+
+            cand_self = order_self[np.repeat(np.arange(len(self)), counts)]
+            cand_other = order_other[np.repeat(lo, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)]
+
+            close = np.linalg.norm(self.xyz[cand_self] - other.xyz[cand_other], axis=-1) <= chord
+            pair_self.append(self.owners[cand_self[close]])
+            pair_other.append(other.owners[cand_other[close]])
+
+        if len(pair_self) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        pair_self = np.concatenate(pair_self)
+        pair_other = np.concatenate(pair_other)
+
+        # Tracks are sampled at several points, so collapse to unique pairs of reports
+        n_other = other.owners.max() + 1
+        pair_keys = np.unique(pair_self * n_other + pair_other)
+        return pair_keys // n_other, pair_keys % n_other
+
+
+def _sample_spacing(km):
+    # Tracks are sampled every km / 2, so a radius of zero would need infinitely many points
+    if km <= 0:
+        raise ValueError("Search radius has to be positive (got %g km)" % km)
+    return min(km / 2., 5.)
+
+
+def join_nearby(left, right, km=50, minutes=60, grouped=False):
+    spacing = _sample_spacing(km)
+    left_idx = SpaceTimeIndex.from_list(left, spacing)
+    right_idx = SpaceTimeIndex.from_list(right, spacing)
+
+    idx_left, idx_right = left_idx.pairs(right_idx, km, minutes)
+
+    if grouped:
+        splits = np.flatnonzero(np.diff(idx_left)) + 1
+        return dict(
+            (int(grp_left[0]), right._subset(grp_right))
+            for grp_left, grp_right in zip(np.split(idx_left, splits), np.split(idx_right, splits))
+            if len(grp_left) > 0
+        )
+
+    return idx_left, idx_right
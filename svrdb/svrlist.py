@@ -1,53 +1,235 @@
 
-from .parsers import TornadoUnpacker, WindUnpacker, HailUnpacker
-from .searchable import Searchable
+from .parsers import TornadoUnpacker, SegmentUnpacker, WindUnpacker, HailUnpacker
+from .wind import _mag_type
+from .searchable import Searchable, _to_set, _timestamp, _timestamp_ceil, _epoch
 from .fips import fips
 from .plotters import plot_tornadoes, plot_wind, plot_hail
+from .cluster import cluster_labels, outbreaks
+from .geometry import TrackIndex, Region
+from .climatology import climatology, _km_per_mile
+from .cache import QueryCache, query_key, result_nbytes
+from .query import Query
+from .partitioned import PartitionedDB
+from .profiling import stage
+from . import columnar
 
 import pandas as pd
+import numpy as np
 
 import sys
 import os
+import warnings
+import gzip
+import bz2
+import lzma
+import shutil
+import hashlib
 from math import log10
-from datetime import datetime, timedelta
+from datetime import timedelta
 from collections import defaultdict
+from functools import lru_cache
 from io import StringIO
 
+try:
+    from compression import zstd as _zstd
+except ImportError:
+    try:
+        import zstandard as _zstd
+    except ImportError:
+        _zstd = None
+
+# Compressed versions of the data files that can be read, in the order load_db() looks for them
+_compressions = {
+    '.zst': lambda fname, mode: _zstd.open(fname, mode),
+    '.gz': gzip.open,
+    '.xz': lzma.open,
+    '.bz2': bz2.open,
+}
+
+def _open_data(fname, mode='rb'):
+    ext = os.path.splitext(fname)[1].lower()
+    if ext == '.zst' and _zstd is None:
+        raise RuntimeError("Must have zstandard installed to read or write .zst files")
+
+    opener = _compressions.get(ext, open)
+    return opener(fname, mode)
+
+
+def _data_fingerprint(fname):
+    # Size and hash of the uncompressed data, which are the same for the CSV and any compressed copy of it
+    sha1 = hashlib.sha1()
+    size = 0
+    with _open_data(fname, 'rb') as fobj:
+        for block in iter(lambda: fobj.read(1024 ** 2), b''):
+            sha1.update(block)
+            size += len(block)
+    return {'size': size, 'sha1': sha1.hexdigest()}
+
+
+@lru_cache(maxsize=None)
+def _county_fips(cty_name, state):
+    fips_dct = fips.lookup_name(cty_name, state)
+    return fips_dct['state_fips'] * 1000 + fips_dct['county_fips']
+
+
 class SVRList(Searchable):
+    # Low-cardinality columns that get an inverted index, and the keys that refer to them
+    indexed_cols = {
+        'st': 'st',
+        'state': 'st',
+        'mag': 'mag',
+        'magnitude': 'mag',
+        'cty_fips': 'cty_fips',
+        'datetime.year': 'datetime.year',
+        'mag_code': 'mag_code',
+        'mag_type': 'mag_type',
+        'is_ef': 'is_ef',
+    }
+
+    @classmethod
+    def _data_fnames(cls):
+        data_dir = os.path.join(os.path.dirname(__file__), 'data')
+        csv_fname = os.path.join(data_dir, cls.db_fname)
+        columnar_fname = os.path.splitext(csv_fname)[0] + '.svrc'
+
+        compressed = [ csv_fname + ext for ext in _compressions.keys() if ext != '.zst' or _zstd is not None ]
+        return columnar_fname, compressed + [ csv_fname ]
+
+    @classmethod
+    def _find_data(cls):
+        # Use the columnar version of the database if it's there, then a compressed version, then the CSV, skipping
+        # copies that weren't made from the data in the CSV (or the compressed file, if there's no CSV). File times
+        # aren't used, since they don't survive installing from a wheel or sdist.
+        columnar_fname, csv_fnames = cls._data_fnames()
+        sources = [ fname for fname in csv_fnames if os.path.exists(fname) ]
+        if not os.path.exists(columnar_fname) and len(sources) == 0:
+            raise FileNotFoundError("Can't find the data for %s (looked for %s)" % (cls.__name__, cls.db_fname))
+        if len(sources) == 0:
+            return columnar_fname
+
+        src_fname = sources[-1]
+        src_fingerprint = _data_fingerprint(src_fname)
+        for fname in [ columnar_fname ] + sources[:-1]:
+            if not os.path.exists(fname):
+                continue
+
+            fingerprint = columnar.read_header(fname).get('source') if fname == columnar_fname else _data_fingerprint(fname)
+            if fingerprint == src_fingerprint:
+                return fname
+
+            warnings.warn("%s wasn't made from the current %s, so it's being skipped (run 'python -m svrdb pack-data' to update it)" %
+                          (os.path.basename(fname), os.path.basename(src_fname)))
+        return src_fname
+
     @classmethod
     def load_db(cls):
-        fname = os.path.join(os.path.dirname(__file__), 'data', cls.db_fname)
-        return cls.from_csv(fname)
+        columnar_fname, _ = cls._data_fnames()
+        with stage('load_db', db=cls.__name__) as stg:
+            fname = cls._find_data()
+            if fname == columnar_fname:
+                svr_list = cls.from_columnar(fname)
+            else:
+                svr_list = cls.from_csv(fname)
+            stg.rows = len(svr_list)
+        return svr_list
+
+    @classmethod
+    def pack_db(cls, fmt='gz'):
+        # Writes a compressed ('zst', 'gz', 'xz', or 'bz2') or columnar ('svrc') copy of the database for load_db()
+        columnar_fname, csv_fnames = cls._data_fnames()
+        try:
+            src_fname = next(fname for fname in csv_fnames[::-1] if os.path.exists(fname))
+        except StopIteration:
+            raise FileNotFoundError("Can't find the data for %s (looked for %s)" % (cls.__name__, cls.db_fname))
+
+        if fmt == 'svrc':
+            # The columnar file records which data it was made from, so load_db() can tell if it's out of date
+            cls.from_csv(src_fname).to_columnar(columnar_fname, source=_data_fingerprint(src_fname))
+            return columnar_fname
+
+        if '.' + fmt not in _compressions:
+            raise ValueError("Unknown format '%s'" % fmt)
+
+        dest_fname = csv_fnames[-1] + '.' + fmt
+        with _open_data(src_fname, 'rb') as src, _open_data(dest_fname, 'wb') as dest:
+            shutil.copyfileobj(src, dest)
+        return dest_fname
 
     @classmethod
     def from_csv(cls, fname):
-        return cls.from_fobj(open(fname, 'rb'))
+        with _open_data(fname, 'rb') as fobj:
+            return cls.from_fobj(fobj)
 
     @classmethod
     def from_fobj(cls, fobj):
-        return cls.from_txt(fobj.read().decode('utf-8'))
+        # pandas parses as it reads, so compressed files are decompressed a piece at a time instead of all at once
+        return cls._from_stream(fobj)
 
     @classmethod
     def from_txt(cls, txt):
-        sio = StringIO(txt)
-        df = pd.read_csv(sio, index_col=False, dtype={'mt': str})
+        return cls._from_stream(StringIO(txt))
+
+    @classmethod
+    def _from_stream(cls, fobj):
+        with stage('read_csv') as stg:
+            df = pd.read_csv(fobj, index_col=False, dtype={'mt': str, 'st': 'category'})
 
-        df.sort_values(['date', 'time'], axis='index', inplace=True)
+            df.sort_values(['date', 'time'], axis='index', inplace=True)
+            stg.rows = len(df)
 
         unpacker = cls.unpacker()
-        reports = unpacker.parse(df)
-        svrs = unpacker.merge(reports)
+        with stage('parse') as stg:
+            stg.rows = len(df)
+            reports = unpacker.parse(df)
+
+        with stage('merge') as stg:
+            svrs = unpacker.merge(reports)
+            stg.rows = len(reports)
+
+        with stage('sort'):
+            svr_list = cls(*svrs)._time_sorted()
+        return svr_list
+
+    @classmethod
+    def from_columnar(cls, fname):
+        with stage('load_columnar', db=cls.__name__) as stg:
+            svr_list = columnar.load(cls, fname)
+            stg.rows = len(svr_list)
+        return svr_list
 
-        return cls(*svrs)
+    @classmethod
+    def attach(cls, name):
+        return columnar.attach(cls, name)
+
+    def to_columnar(self, fname, source=None):
+        with stage('export_columnar', db=type(self).__name__) as stg:
+            columnar.save(self, fname, source=source)
+            stg.rows = len(self)
+
+    def publish(self, name=None):
+        with stage('publish', db=type(self).__name__) as stg:
+            shared = columnar.publish(self, name=name)
+            stg.rows = len(self)
+        return shared
+
+    def to_partitioned(self, directory, max_bytes=256 * 1024 ** 2):
+        return PartitionedDB.create(directory, self, max_bytes=max_bytes)
 
     def to_csv(self, fname):
-        with open(fname, 'w') as csvf:
+        with stage('export_csv', db=type(self).__name__) as stg, _open_data(fname, 'wt') as csvf:
             first_pass = True
             for svr in self:
                 entries = svr.to_csv(headers=first_pass)
                 csvf.write(entries)
 
                 first_pass = False
+            stg.rows = len(self)
+
+    def __init__(self, *lst):
+        super().__init__(*lst)
+        self._columns = {}
+        self._indexes = {}
+        self._cache = None
 
     def __init_subclass__(cls, unpacker, plotter, db_fname):
         super().__init_subclass__()
@@ -107,21 +289,274 @@ class SVRList(Searchable):
 
         return html_str + '</table>'
 
-    def search(self, **keys):
-        def extract_fips(fips_dct):
-            return fips_dct['state_fips'] * 1000 + fips_dct['county_fips']
+    def _subset(self, positions):
+        if isinstance(self._lst, columnar.ColumnarItems):
+            # Subsets of columnar data read from the same columns, so nothing gets built until it's used
+            subset = type(self)()
+            subset._lst = self._lst.take(positions)
+        elif isinstance(positions, slice):
+            subset = type(self)(*self._lst[positions])
+        else:
+            subset = type(self)(*[ self._lst[pos] for pos in positions ])
+
+        for name, col in self._columns.items():
+            subset._columns[name] = col[positions]
+
+        # Taking reports in order from a time-sorted list keeps it time-sorted
+        if self._indexes.get('time_order', False) is None:
+            if isinstance(positions, slice) or (np.diff(positions) > 0).all():
+                subset._indexes['time_order'] = None
+        return subset
+
+    def _timestamps(self):
+        try:
+            times = self._columns['datetime']
+        except KeyError:
+            times = np.array([ _timestamp(svr['datetime']) for svr in self ], dtype=np.int64)
+            self._columns['datetime'] = times
+        return times
+
+    def _column(self, col):
+        try:
+            vals = self._columns[col]
+        except KeyError:
+            vals = np.array(self[col], dtype=float)
+            self._columns[col] = vals
+        return vals
+
+    def _time_index(self):
+        try:
+            return self._indexes['time_order']
+        except KeyError:
+            pass
+
+        # None means the list is already in time order
+        times = self._timestamps()
+        if (times[1:] >= times[:-1]).all():
+            order = None
+        else:
+            order = np.argsort(times, kind='stable')
+
+        self._indexes['time_order'] = order
+        return order
+
+    def _time_sorted(self):
+        order = self._time_index()
+        if order is None:
+            return self
+
+        svr_list = self._subset(order)
+        svr_list._indexes['time_order'] = None
+        return svr_list
+
+    def slice_time(self, start, end):
+        times = self._timestamps()
+        order = self._time_index()
+        if order is not None:
+            times = times[order]
+
+        lbi = np.searchsorted(times, _timestamp_ceil(start), side='left')
+        ubi = np.searchsorted(times, _timestamp_ceil(end), side='left')
+
+        if order is None:
+            return slice(int(lbi), int(ubi))
+        return np.sort(order[lbi:ubi])
+
+    def between(self, start, end):
+        return self._subset(self.slice_time(start, end))
+
+    def _inverted_index(self, col):
+        try:
+            return self._indexes[col]
+        except KeyError:
+            pass
+
+        if col == 'datetime.year':
+            values = (self._timestamps().astype('datetime64[s]').astype('datetime64[Y]').astype(np.int64) + 1970).tolist()
+        elif isinstance(self._lst, columnar.ColumnarItems) and self._lst.postings(col) is not None:
+            self._indexes[col] = self._lst.postings(col)
+            return self._indexes[col]
+        elif '.' in col:
+            group, attr = col.split('.', 1)
+            values = [ getattr(svr[group], attr) for svr in self ]
+        else:
+            values = [ svr[col] for svr in self ]
+
+        # Tornadoes can have several states and counties, so they get listed under each one
+        postings = defaultdict(list)
+        multi_valued = False
+        for pos, val in enumerate(values):
+            if isinstance(val, list):
+                multi_valued = True
+                for v in set(val):
+                    postings[v].append(pos)
+            else:
+                postings[val].append(pos)
+
+        postings = dict((val, np.array(pos, dtype=np.int64)) for val, pos in postings.items())
+        self._indexes[col] = (postings, multi_valued)
+        return self._indexes[col]
+
+    def _index_lookup(self, col, val):
+        vals = [ val ] if callable(val) else _to_set(val)
+        if any(callable(v) for v in vals):
+            if not all(callable(v) for v in vals):
+                return None
+
+            # Functions only have to be called once for each value in the index, unless the values are lists
+            postings, multi_valued = self._inverted_index(col)
+            if multi_valued:
+                return None
+            try:
+                vals = [ key for key in postings.keys() if all(v(key) for v in vals) ]
+            except TypeError:
+                return None
+        else:
+            postings, _ = self._inverted_index(col)
+
+        matches = [ postings[v] for v in vals if v in postings ]
+        if len(matches) == 0:
+            return np.zeros(0, dtype=np.int64)
+        elif len(matches) == 1:
+            return matches[0]
+        return np.unique(np.concatenate(matches))
+
+    def _search_positions(self, conditions):
+        def intersect(pos1, pos2):
+            if isinstance(pos1, slice) and isinstance(pos2, slice):
+                start = max(pos1.start, pos2.start)
+                return slice(start, max(min(pos1.stop, pos2.stop), start))
+            elif isinstance(pos1, slice):
+                return pos2[(pos2 >= pos1.start) & (pos2 < pos1.stop)]
+            elif isinstance(pos2, slice):
+                return pos1[(pos1 >= pos2.start) & (pos1 < pos2.stop)]
+            return np.intersect1d(pos1, pos2, assume_unique=True)
+
+        positions = slice(0, len(self))
+        residual = []
+
+        for key, val in conditions:
+            if key == 'datetime' and getattr(val, 'ranges', None) is not None:
+                time_slices = [ self.slice_time(start, end) for start, end in val.ranges ]
+                if len(time_slices) == 1:
+                    positions = intersect(positions, time_slices[0])
+                else:
+                    time_pos = np.unique(np.concatenate([ np.arange(len(self))[sl] for sl in time_slices ]))
+                    positions = intersect(positions, time_pos)
+
+            elif key in type(self).indexed_cols:
+                try:
+                    index_pos = self._index_lookup(type(self).indexed_cols[key], val)
+                except TypeError:
+                    # Unhashable search values can't be looked up in the index
+                    index_pos = None
+
+                if index_pos is None:
+                    residual.append((key, val))
+                else:
+                    positions = intersect(positions, index_pos)
 
-        if 'county' in keys:
-            ctys = keys.pop('county')
-            if type(ctys) == tuple:
-                cty_fips = extract_fips(fips.lookup_name(*ctys))
             else:
-                cty_fips = [extract_fips(fips.lookup_name(*cty)) for cty in ctys]
+                residual.append((key, val))
+
+        # The same column can show up more than once, so split up the rest into sets of unique columns
+        residual_keys = []
+        for key, val in residual:
+            for keys in residual_keys:
+                if key not in keys:
+                    keys[key] = val
+                    break
+            else:
+                residual_keys.append({key: val})
+
+        if len(residual_keys) > 0:
+            cand_pos = np.arange(len(self))[positions]
+            with stage('match') as stg:
+                positions = [ pos for pos in cand_pos if all(self._lst[pos].matches(**keys) for keys in residual_keys) ]
+                positions = np.array(positions, dtype=np.int64)
+                stg.rows = len(cand_pos)
+
+        return positions
+
+    def enable_cache(self, maxsize=128, max_bytes=None):
+        self._cache = QueryCache(maxsize=maxsize, max_bytes=max_bytes)
+
+    def disable_cache(self):
+        self._cache = None
+
+    def cache_info(self):
+        if self._cache is None:
+            return None
+        return self._cache.info()
+
+    def invalidate(self):
+        self._columns = {}
+        self._indexes = {}
+        if self._cache is not None:
+            self._cache.clear()
+
+    def _resolve_conditions(self, conditions):
+        resolved = []
+        for key, val in conditions:
+            if key == 'county':
+                if type(val) == tuple:
+                    val = _county_fips(*val)
+                else:
+                    val = [_county_fips(*cty) for cty in val]
+                key = 'cty_fips'
+            elif key == 'mag_type' and not callable(val):
+                val = _mag_type(val) if isinstance(val, (str, int, np.integer)) else [_mag_type(mt) for mt in val]
+
+            resolved.append((key, val))
+        return resolved
+
+    def _search(self, conditions):
+        conditions = self._resolve_conditions(conditions)
+
+        cache_key = None
+        if self._cache is not None:
+            aliases = dict(type(self).unpacker.report_primitive.aliases)
+            # 'counties' gives county names for tornadoes, but FIPS codes for wind and hail
+            aliases.pop('counties', None)
+
+            cache_key = query_key(conditions, aliases)
+            if cache_key is not None:
+                result = self._cache.get(cache_key)
+                if result is not None:
+                    return result
+
+        result = self._subset(self._search_positions(conditions))
+
+        if cache_key is not None:
+            self._cache.put(cache_key, result, result_nbytes(result))
+        return result
 
-            keys['cty_fips'] = cty_fips
-        return super().search(**keys)
+    def search(self, **keys):
+        with stage('search', db=type(self).__name__) as stg:
+            result = self._search(list(keys.items()))
+            stg.rows = len(self)
+        return result
+
+    def query(self):
+        return Query(self)
+
+    def _groupby(self, group, positions=None):
+        index_col = type(self).indexed_cols.get(group)
+        if index_col is not None:
+            postings, multi_valued = self._inverted_index(index_col)
+            if not multi_valued:
+                if positions is not None:
+                    keep = np.zeros(len(self), dtype=bool)
+                    keep[positions] = True
+                    postings = dict((key, grp[keep[grp]]) for key, grp in postings.items())
+                    postings = dict((key, grp) for key, grp in postings.items() if len(grp) > 0)
+
+                groups = sorted(postings.items(), key=lambda grp: grp[1][0])
+                return dict((key, self._subset(grp)) for key, grp in groups)
+
+        if positions is not None:
+            return self._subset(positions).groupby(group)
 
-    def groupby(self, group):
         if '.' in group:
             group, attr = group.split('.', 1)
         else:
@@ -133,27 +568,127 @@ class SVRList(Searchable):
             keys = [getattr(key, attr) for key in keys]
 
         groups = defaultdict(list)
-        for key, svr in zip(keys, self):
-            groups[key].append(svr)
+        for pos, key in enumerate(keys):
+            groups[key].append(pos)
 
-        return dict((key, type(self)(*grp)) for key, grp in groups.items())
+        return dict((key, self._subset(np.array(grp, dtype=np.int64))) for key, grp in groups.items())
+
+    def groupby(self, group):
+        with stage('groupby', db=type(self).__name__) as stg:
+            groups = self._groupby(group)
+            stg.rows = len(self)
+        return groups
 
     def days(self):
+        # Convective days run from 12Z to 12Z
+        day_starts = (self._timestamps() - 12 * 3600) // 86400 * 86400 + 12 * 3600
+
         svr_days = defaultdict(list)
-        for svr in self:
-            svr_day = (svr['datetime'] - timedelta(hours=12)).replace(hour=12, minute=0, second=0, microsecond=0)
-            svr_days[svr_day].append(svr)
+        for pos, start in enumerate(day_starts.tolist()):
+            svr_days[start].append(pos)
+
+        return dict((_epoch + timedelta(seconds=start), self._subset(np.array(svr_days[start], dtype=np.int64)))
+                    for start in sorted(svr_days.keys()))
+
+    def cluster_labels(self, km=50, minutes=60, min_reports=5):
+        return cluster_labels(self, km=km, minutes=minutes, min_reports=min_reports)
+
+    def outbreaks(self, km=50, minutes=60, min_reports=5, score=len):
+        return outbreaks(self, km=km, minutes=minutes, min_reports=min_reports, score=score)
+
+    def climatology(self, lat_edges=None, lon_edges=None, km=25 * _km_per_mile, sigma_days=15, sigma_km=120, cache_dir=None, workers=None):
+        return climatology(self, lat_edges=lat_edges, lon_edges=lon_edges, km=km, sigma_days=sigma_days, sigma_km=sigma_km,
+                           cache_dir=cache_dir, workers=workers)
+
+    def to_grid(self, lat_edges, lon_edges):
+        grid, _, _ = np.histogram2d(self._column('slat'), self._column('slon'), bins=(lat_edges, lon_edges))
+        return grid.astype(np.int64)
+
+    def track_index(self):
+        try:
+            return self._indexes['tracks']
+        except KeyError:
+            index = TrackIndex.from_list(self)
+            self._indexes['tracks'] = index
+            return index
+
+    def track_lengths(self):
+        return self.track_index().track_lengths()
 
-        return dict((svr_day, type(self)(*svr_days[svr_day])) for svr_day in sorted(svr_days.keys()))
+    def clipped_lengths(self, region):
+        if isinstance(region, Region):
+            return self.track_index().clipped_lengths(region)
+        lengths = [ self.track_index().clipped_lengths(reg) for reg in region ]
+        return np.column_stack(lengths) if len(lengths) > 0 else np.zeros((len(self), 0))
+
+    def crossing(self, region):
+        return self._subset(np.flatnonzero(self.track_index().crosses(region)))
 
     def plot(self, label=None, filename=None):
-        type(self).plotter(self, label=label, filename=filename)
+        with stage('plot', db=type(self).__name__) as stg:
+            type(self).plotter(self, label=label, filename=filename)
+            stg.rows = len(self)
 
 
 class TornadoList(SVRList, unpacker=TornadoUnpacker, 
                            plotter=plot_tornadoes,
                            db_fname='1950-2022_all_tornadoes.csv'):
-    pass
+    def segments(self):
+        try:
+            return self._indexes['segments']
+        except KeyError:
+            pass
+
+        segs = []
+        parents = []
+        for idx, tor in enumerate(self):
+            segs.extend(tor._state_segs)
+            parents.extend([idx] * len(tor._state_segs))
+
+        parents = np.array(parents, dtype=np.int64)
+
+        seg_list = SegmentList(*segs)
+        seg_list._tornadoes = self
+        seg_list._parents = parents
+        seg_list._columns['datetime'] = self._timestamps()[parents]
+        if self._time_index() is None:
+            seg_list._indexes['time_order'] = None
+
+        self._indexes['segments'] = seg_list
+        return seg_list
+
+
+class SegmentList(SVRList, unpacker=SegmentUnpacker,
+                           plotter=plot_tornadoes,
+                           db_fname='1950-2022_all_tornadoes.csv'):
+    def __init__(self, *lst):
+        super().__init__(*lst)
+        self._tornadoes = None
+        self._parents = None
+
+    @classmethod
+    def load_db(cls):
+        return TornadoList.load_db().segments()
+
+    @classmethod
+    def _from_stream(cls, fobj):
+        return TornadoList._from_stream(fobj).segments()
+
+    def _subset(self, positions):
+        subset = super()._subset(positions)
+        if self._tornadoes is not None:
+            subset._tornadoes = self._tornadoes
+            subset._parents = self._parents[positions]
+        return subset
+
+    @property
+    def parent_index(self):
+        return self._parents
+
+    def tornadoes(self):
+        if self._tornadoes is None:
+            raise ValueError("These segments didn't come from a TornadoList")
+        return self._tornadoes._subset(np.unique(self._parents))
 
 
 class WindList(SVRList, unpacker=WindUnpacker, 
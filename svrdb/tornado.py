@@ -6,8 +6,9 @@ from .searchable import SearchableItem
 from .fips import fips
 
 _epoch = datetime(1970, 1, 1, 0)
+_ef_start = datetime(2007, 2, 1, 0)
 
-class TornadoSegment(object):
+class TornadoSegment(SearchableItem):
     aliases = {
         'state':'st',
         'magnitude':'mag',
@@ -56,8 +57,7 @@ class TornadoSegment(object):
         def replace_fips(old, new):
             cty_fips = self._attrs['cty_fips']
             if old in cty_fips:
-                cty_fips[cty_fips.index(old)] = new
-                cty_fips = list(set(cty_fips))
+                cty_fips = list(dict.fromkeys(new if cf == old else cf for cf in cty_fips))
             self._attrs['cty_fips'] = cty_fips
 
         replace_fips(46131, 46071) # Washabaugh County, SD merged with Jackson County, SD
@@ -100,14 +100,17 @@ class TornadoSegment(object):
         else:
             merge_sg = other
 
-        merge_sg._attrs['cty_fips'] = self['cty_fips'] + other['cty_fips']
+        # Counties listed on more than one line only count once, so writing the tornado out and reading it back in
+        # gives the same counties
+        merge_sg._attrs['cty_fips'] = list(dict.fromkeys(self['cty_fips'] + other['cty_fips']))
         return merge_sg
 
-    def to_csv(self):
+    def to_csv(self, headers=False):
         cols = TornadoSegment.cols
         fips_cols = ['f1', 'f2', 'f3', 'f4']
 
-        attrs = self._attrs
+        # Work on a copy, since the continuation lines overwrite the track
+        attrs = dict(self._attrs)
         tor_dt = attrs['datetime'] - timedelta(hours=6)
         attrs['yr'] = tor_dt.year
         attrs['mo'] = tor_dt.month
@@ -140,6 +143,9 @@ class TornadoSegment(object):
                           'inj': 0, 'fat': 0, 'loss': 0, 'closs': 0})
 
         csv += ",".join(str(attrs[c]) for c in cols) + "\n"
+
+        if headers:
+            csv = ",".join(cols) + "\n" + csv
         return csv
 
     def __getitem__(self, attr):
@@ -151,7 +157,22 @@ class TornadoSegment(object):
         return self._attrs[attr]
 
     def __str__(self):
-        return str(self._attrs)
+        time_str = self['datetime'].strftime("%Y-%m-%d %H:%M")
+        mag = self._get_mag_str()
+        return "%16s %11s %5s" % (time_str, self['st'], mag)
+
+    def _repr_html_(self, _make_table=True):
+        html_str = ''
+        if _make_table:
+            html_str += '<table><tr>'
+
+        time_str = self['datetime'].strftime("%Y-%m-%d %H:%M")
+        mag_str = self._get_mag_str()
+        html_str += '<td>%s</td><td>%s</td>' % (time_str, mag_str)
+
+        if _make_table:
+            html_str += '</tr></table>'
+        return html_str
 
     def __repr__(self):
         return repr(self._attrs)
@@ -160,11 +181,24 @@ class TornadoSegment(object):
         for k, v in self._attrs.items():
             yield k, v
 
+    def _get_mag_str(self):
+        # Reports that didn't come from the parser don't have the derived columns
+        try:
+            return self['mag_code']
+        except KeyError:
+            pass
+
+        is_ef = self._attrs.get('is_ef', self['datetime'] >= _ef_start)
+        return ("EF" if is_ef else "F") + ('U' if self['mag'] < 0 else str(self['mag']))
+
 
 class Tornado(SearchableItem):
-    def __init__(self, segments):
+    def __init__(self, segments, state_segments=None):
         self._segs = segments
 
+        # One segment per state, with the values for just that state
+        self._state_segs = segments if state_segments is None else state_segments
+
     def __str__(self):
         time_str = self['datetime'].strftime("%Y-%m-%d %H:%M")
         states = ", ".join(self['st'])
@@ -199,18 +233,29 @@ class Tornado(SearchableItem):
         states = states_unique
 
         seg_list = []
+        state_seg_list = []
 
         for st in states:
             st_segs = segments_st[st]
             if len(st_segs) > 1:
+                # The state segment can get merged into the whole-tornado segment, so keep it around separately
+                state_seg = next((seg for seg in st_segs if seg['sn'] == 1), None)
+
                 accum_seg = st_segs[0]
                 for seg in st_segs[1:]:
                     accum_seg = accum_seg.merge(seg)
                 seg_list.append(accum_seg)
+
+                if state_seg is None or state_seg is accum_seg:
+                    state_seg_list.append(accum_seg)
+                else:
+                    state_seg._attrs['cty_fips'] = list(dict.fromkeys(accum_seg['cty_fips']))
+                    state_seg_list.append(state_seg)
             else:
                 seg_list.extend(st_segs)
+                state_seg_list.extend(st_segs)
 
-        return cls(seg_list)
+        return cls(seg_list, state_seg_list)
 
     def to_csv(self, headers=False):
         csv = ""
@@ -219,36 +264,20 @@ class Tornado(SearchableItem):
         if headers:
             csv += ",".join(cols) + "\n"
 
-        if len(self._segs) > 1:
-            self_dict = {}
-            for col in cols:
-                if col == 'yr':
-                    val = (self['datetime'] - timedelta(hours=6)).year
-                elif col == 'mo':
-                    val = (self['datetime'] - timedelta(hours=6)).month
-                elif col == 'dy':
-                    val = (self['datetime'] - timedelta(hours=6)).day
-                elif col == 'date':
-                    val = (self['datetime'] - timedelta(hours=6)).strftime("%Y-%m-%d")
-                elif col == 'time':
-                    val = (self['datetime'] - timedelta(hours=6)).strftime("%H:%M:%S")
-                elif col == 'tz':
-                    val = 3
-                elif col in ['f1', 'f2', 'f3', 'f4']:
-                    val = 0
-                elif col in ['om', 'st', 'stf', 'stn', 'ns', 'sn', 'sg']:
-                    val = self[col][0]
-                else:
-                    val = self[col]
-                self_dict[col] = val
-
-            if self_dict['ns'] > 1:
-                self_dict['sn'] = 0
-                self_dict['sg'] = 1
-
-            csv += ",".join(str(self_dict[col]) for col in cols) + "\n"
-
-        for seg in self._segs:
+        # Tornadoes listed in more than one state get a line for the whole track (the patched tornadoes are listed
+        # in one state, but have a segment in another). The counties are already on the state lines.
+        whole_seg = None
+        if len(self._segs) > 1 and self['ns'][0] > 1:
+            seg = next((seg for seg in self._segs if seg['sn'] == 0), self._segs[0])
+            whole_seg = TornadoSegment.__new__(TornadoSegment)
+            whole_seg._attrs = dict(seg._attrs, sn=0, sg=1, cty_fips=[])
+
+        # The whole-tornado line covers the merged segments, so each state gets its own values after it. It goes
+        # right before its own state, so the states come back in the same order.
+        for seg in self._state_segs:
+            if whole_seg is not None and seg['st'] == whole_seg['st']:
+                csv += whole_seg.to_csv()
+                whole_seg = None
             csv += seg.to_csv()
 
         return csv
@@ -265,8 +294,11 @@ class Tornado(SearchableItem):
             result = max(attr_list)
         elif db_attr in [ 'len', 'fat', 'inj' ]:
             result = attr_list[0] #sum(attr_list)
-        elif db_attr in [ 'datetime', 'slat', 'slon' ]:
+        elif db_attr in [ 'datetime', 'slat', 'slon', 'is_ef' ]:
             result = attr_list[0]
+        elif db_attr in [ 'mag_code', 'mag_value' ]:
+            # Goes with the magnitude, which is the highest over all the segments
+            result = max(self._segs, key=lambda seg: seg['mag'])[db_attr]
         elif db_attr in [ 'elat', 'elon' ]:
             result = attr_list[-1]
         elif db_attr in [ 'cty_fips' ]:
@@ -283,5 +315,4 @@ class Tornado(SearchableItem):
         return result
 
     def _get_mag_str(self):
-        mag_str = 'U' if self['mag'] < 0 else str(self['mag'])
-        return "EF%s" % mag_str if self['datetime'] >= datetime(2007, 2, 1, 0) else "F%s" % mag_str
+        return max(self._segs, key=lambda seg: seg['mag'])._get_mag_str()
@@ -2,9 +2,27 @@
 from .searchable import SearchableItem
 
 from datetime import datetime, timedelta
+from enum import IntEnum
 
 _epoch = datetime(1970, 1, 1, 0)
 
+class MagType(IntEnum):
+    # Whether a wind gust was measured or estimated. They're stored as the integer values, so they can be searched and
+    # grouped like any other integer column.
+    UNKNOWN = 0
+    MEASURED = 1
+    ESTIMATED = 2
+
+def _mag_type(val):
+    # Magnitude types can also be given by name (e.g. 'measured'), and a name or value that isn't one of them is an
+    # error instead of something that silently matches nothing
+    if isinstance(val, str):
+        try:
+            return MagType[val.upper()]
+        except KeyError:
+            raise ValueError("Unknown magnitude type '%s' (must be one of %s)" % (val, ", ".join(mt.name.lower() for mt in MagType)))
+    return MagType(val)
+
 class Wind(SearchableItem):
     aliases = {
         'state':'st',
@@ -56,9 +74,4 @@ class Wind(SearchableItem):
         return html_str
 
     def _get_mag_str(self):
-        if self['mag'] == 0:
-            mag = '--'
-        else:
-            acc = self['mt'][0] if type(self['mt']) != float else ''
-            mag = "%s%d" % (acc, self['mag'])
-        return mag
+        return self['mag_code']
@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+from svrdb.difftest import verify, format_divergences, generate_csv, reference_parse, _records
+from svrdb.svrlist import TornadoList, SegmentList
+
+def test_fast_paths_match_reference():
+    divergences = verify(seed=0, n_datasets=1, n_reports=200, n_queries=30)
+    assert len(divergences) == 0, format_divergences(divergences)
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+@pytest.mark.parametrize('list_cls,kind', [(TornadoList, 'tornado'), (SegmentList, 'segment')])
+def test_csv_round_trip(tmp_path, list_cls, kind, seed):
+    reference = reference_parse(kind, generate_csv('tornado', 150, seed=seed))
+
+    fname = os.path.join(tmp_path, 'round_trip.csv')
+    list_cls.from_txt(generate_csv('tornado', 150, seed=seed)).to_csv(fname)
+    assert _records(list_cls.from_csv(fname)) == _records(reference)
+
+    # Writing it out again doesn't change anything either
+    fname_again = os.path.join(tmp_path, 'round_trip_again.csv')
+    list_cls.from_csv(fname).to_csv(fname_again)
+    assert _records(list_cls.from_csv(fname_again)) == _records(reference)
+
+
+@pytest.mark.parametrize('year,om,patched_st', [(1993, 74, 'NE'), (2006, 80, 'IL')])
+def test_patched_segments(tmp_path, year, om, patched_st):
+    csv = generate_csv('tornado', 20, seed=0)
+    tor_db = TornadoList.from_txt(csv)
+
+    def find(svr_list):
+        return [ tor for tor in svr_list if tor['datetime'].year == year and tor['om'][0] == om ]
+
+    tors = find(tor_db)
+    assert len(tors) == 1
+    assert tors[0]['st'] == ['KS', patched_st]
+    assert _records(TornadoList(*tors)) == _records(TornadoList(*find(reference_parse('tornado', csv))))
+
+    # The patch isn't applied a second time when the tornado is read back in
+    fname = os.path.join(tmp_path, 'patched.csv')
+    TornadoList(*tors).to_csv(fname)
+    reloaded = find(TornadoList.from_csv(fname))
+    assert len(reloaded) == 1
+    assert reloaded[0]['st'] == ['KS', patched_st]
+    assert _records(TornadoList(*reloaded)) == _records(TornadoList(*tors))
@@ -0,0 +1,61 @@
+import os
+import warnings
+
+import pytest
+
+from svrdb.difftest import generate_csv, _records
+from svrdb.svrlist import TornadoList
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    csv_fname = os.path.join(tmp_path, 'tornadoes.csv')
+    columnar_fname = os.path.join(tmp_path, 'tornadoes.svrc')
+    monkeypatch.setattr(TornadoList, '_data_fnames', classmethod(lambda cls: (columnar_fname, [ csv_fname + '.gz', csv_fname ])))
+
+    with open(csv_fname, 'w') as fobj:
+        fobj.write(generate_csv('tornado', 50, seed=0))
+    return tmp_path
+
+
+def _find_data():
+    with warnings.catch_warnings(record=True) as warns:
+        warnings.simplefilter('always')
+        fname = TornadoList._find_data()
+    return os.path.basename(fname), [ str(warn.message) for warn in warns ]
+
+
+def test_packed_copies_are_used(data_dir):
+    TornadoList.pack_db(fmt='gz')
+    assert _find_data() == ('tornadoes.csv.gz', [])
+
+    TornadoList.pack_db(fmt='svrc')
+    assert _find_data() == ('tornadoes.svrc', [])
+    assert _records(TornadoList.load_db()) == _records(TornadoList.from_csv(os.path.join(data_dir, 'tornadoes.csv')))
+
+    # Without the CSV, there's nothing to check them against
+    os.remove(os.path.join(data_dir, 'tornadoes.csv'))
+    assert _find_data() == ('tornadoes.svrc', [])
+
+
+def test_stale_copies_are_skipped(data_dir):
+    TornadoList.pack_db(fmt='svrc')
+    TornadoList.pack_db(fmt='gz')
+
+    # Times aren't used, so a packed file that looks newer is still skipped if the data changed
+    with open(os.path.join(data_dir, 'tornadoes.csv'), 'w') as fobj:
+        fobj.write(generate_csv('tornado', 50, seed=1))
+    os.utime(os.path.join(data_dir, 'tornadoes.csv'), (0, 0))
+
+    fname, warns = _find_data()
+    assert fname == 'tornadoes.csv'
+    assert len(warns) == 2 and all("wasn't made from the current tornadoes.csv" in warn for warn in warns)
+
+    # The columnar file is checked against the compressed file once the CSV is gone
+    TornadoList.pack_db(fmt='gz')
+    os.remove(os.path.join(data_dir, 'tornadoes.csv'))
+    fname, warns = _find_data()
+    assert fname == 'tornadoes.csv.gz'
+    assert warns == [ "tornadoes.svrc wasn't made from the current tornadoes.csv.gz, so it's being skipped (run 'python -m svrdb pack-data' to update it)" ]
+
+    TornadoList.pack_db(fmt='svrc')
+    assert _find_data() == ('tornadoes.svrc', [])
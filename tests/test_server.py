@@ -0,0 +1,146 @@
+import asyncio
+import json
+
+import pytest
+
+from svrdb.difftest import generate_csv
+from svrdb.svrlist import TornadoList, WindList
+from svrdb.server import SVRServer
+from svrdb.wind import MagType
+
+@pytest.fixture(scope='module')
+def dbs():
+    return {
+        'tornado': TornadoList.from_txt(generate_csv('tornado', 100, seed=0)),
+        'wind': WindList.from_txt(generate_csv('wind', 2500, seed=0)),
+    }
+
+
+async def _request(port, method, path, body=None):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    if isinstance(body, bytes):
+        data = body
+    else:
+        data = b'' if body is None else json.dumps(body).encode('utf-8')
+
+    writer.write(("%s %s HTTP/1.1\r\nContent-Length: %d\r\n\r\n" % (method, path, len(data))).encode('ascii') + data)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return response
+
+
+def _decode(response):
+    head, _, body = response.partition(b"\r\n\r\n")
+    status_line, *header_lines = head.decode('latin-1').split("\r\n")
+    headers = dict((name.lower(), value.strip()) for name, _, value in (line.partition(':') for line in header_lines))
+
+    if headers.get('transfer-encoding') == 'chunked':
+        data = b''
+        while True:
+            size, _, body = body.partition(b"\r\n")
+            size = int(size, 16)
+            if size == 0:
+                break
+            data += body[:size]
+            body = body[(size + 2):]
+        body = data
+
+    return int(status_line.split()[1]), json.loads(body)
+
+
+def _run_server(dbs, requests, **kwargs):
+    async def run():
+        server = SVRServer(dbs=dbs, **kwargs)
+        try:
+            tcp_server = await server.start(port=0)
+            port = tcp_server.sockets[0].getsockname()[1]
+            return [ _decode(await _request(port, *req)) for req in requests ]
+        finally:
+            server.close()
+
+    return asyncio.run(run())
+
+
+def test_search(dbs):
+    (status, body), = _run_server(dbs, [ ('POST', '/search', {'db': 'wind', 'search': {'mag': {'ge': 65}}}) ])
+
+    expected = dbs['wind'].search(mag=lambda m: m >= 65)
+    assert status == 200
+    assert body['count'] == len(expected) == len(body['results'])
+    assert [ rec['mag'] for rec in body['results'] ] == list(expected['mag'])
+
+
+def test_search_pagination(dbs):
+    search = {'db': 'wind', 'search': {'state': 'OK'}}
+    responses = _run_server(dbs, [
+        ('POST', '/search', search),
+        ('POST', '/search', dict(search, offset=10, limit=5)),
+        ('POST', '/search', dict(search, offset=10 ** 6)),
+    ])
+
+    (_, everything), (status, page), (_, past_end) = responses
+    assert status == 200
+    assert page['results'] == everything['results'][10:15]
+    assert past_end['count'] == 0
+
+
+@pytest.mark.parametrize('page', [ {'offset': -1}, {'limit': -5}, {'offset': '10'}, {'limit': 2.5}, {'offset': True} ])
+def test_search_bad_pagination(dbs, page):
+    (status, body), = _run_server(dbs, [ ('POST', '/search', dict({'db': 'wind'}, **page)) ])
+    assert status == 400
+    assert 'non-negative integer' in body['error']
+
+
+def test_groupby_and_databases(dbs):
+    (status, groups), (_, databases) = _run_server(dbs, [
+        ('POST', '/groupby', {'db': 'tornado', 'groupby': 'mag'}),
+        ('GET', '/databases'),
+    ])
+
+    assert status == 200
+    assert dict((key, cnt) for key, cnt in groups['groups']) == dict((key, len(grp)) for key, grp in dbs['tornado'].groupby('mag').items())
+    assert databases == dict((name, len(db)) for name, db in dbs.items())
+
+
+def test_errors(dbs):
+    responses = _run_server(dbs, [
+        ('POST', '/search', {'db': 'snow'}),
+        ('POST', '/search', {'db': 'wind', 'search': {'mag': {'around': 65}}}),
+        ('POST', '/search', b'{not json'),
+        ('GET', '/search'),
+        ('GET', '/forecast'),
+    ])
+    assert [ status for status, _ in responses ] == [400, 400, 400, 405, 404]
+    assert all('error' in body for _, body in responses)
+
+
+def test_search_processes(dbs):
+    # Larger than a chunk, so the results are encoded on the workers a piece at a time
+    search = {'db': 'wind', 'search': {'mag': {'ge': 0}}}
+    responses = _run_server(dbs, [
+        ('POST', '/search', search),
+        ('POST', '/search', dict(search, offset=1990, limit=20)),
+        ('POST', '/search', dict(search, offset=-1)),
+        ('POST', '/groupby', {'db': 'wind', 'groupby': 'st'}),
+    ], workers=2, processes=True)
+
+    (status, everything), (_, page), (bad_status, _), (_, groups) = responses
+    assert status == 200
+    assert everything['count'] == len(dbs['wind']) == len(everything['results'])
+    assert page['results'] == everything['results'][1990:2010]
+    assert bad_status == 400
+    assert sum(cnt for _, cnt in groups['groups']) == len(dbs['wind'])
+
+
+def test_search_mag_type(dbs):
+    (status, body), (bad_status, error) = _run_server(dbs, [
+        ('POST', '/search', {'db': 'wind', 'search': {'mag_type': 'measured'}}),
+        ('POST', '/search', {'db': 'wind', 'search': {'mag_type': 'mesured'}}),
+    ])
+
+    assert status == 200
+    assert body['count'] == len(dbs['wind'].search(mag_type=MagType.MEASURED)) > 0
+    assert all(rec['mag_type'] == MagType.MEASURED for rec in body['results'])
+    assert bad_status == 400
+    assert 'mesured' in error['error']